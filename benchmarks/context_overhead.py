@@ -0,0 +1,84 @@
+# To run:
+# python benchmarks/context_overhead.py
+#
+# Measures the per-context overhead of entering and exiting a LoggingContext from a deep call stack, comparing the
+# previous inspect-based caller resolution with the single-frame, cached resolution now used by LoggingContext. Each
+# figure is the fastest of several runs, which is the least disturbed by the rest of the system, and includes the cost
+# of reaching the stack depth.
+
+import inspect
+import timeit
+from unittest.mock import patch
+
+import woodchipper
+import woodchipper.context
+from woodchipper.configs import Minimal
+from woodchipper.context import LoggingContext, _resolve_caller
+
+STACK_DEPTH = 60
+ITERATIONS = 5_000
+# The inspect-based resolution takes milliseconds at this depth, so it is run fewer times
+LEGACY_ITERATIONS = 100
+REPEATS = 5
+
+
+def legacy_resolve_caller(depth=1):
+    current_frame = inspect.currentframe()
+    calling_frame = inspect.getouterframes(current_frame, 2)[depth]
+    module = inspect.getmodule(calling_frame[0])
+    module_name = module.__name__ if module else "<unknown>"
+    return module_name, f"{module_name}:{calling_frame[3]}"
+
+
+def legacy_resolve_caller_twice(depth=1):
+    # The caller used to be resolved on entering the context and again on exiting it
+    legacy_resolve_caller(depth + 1)
+    return legacy_resolve_caller(depth + 1)
+
+
+def legacy_resolution_per_context():
+    legacy_resolve_caller()
+    legacy_resolve_caller()
+
+
+def cached_resolve_caller():
+    return _resolve_caller(1)
+
+
+def at_depth(depth, fn):
+    if depth == 0:
+        return fn()
+    return at_depth(depth - 1, fn)
+
+
+def per_call_musec(fn, number=ITERATIONS):
+    timings = timeit.repeat(lambda: at_depth(STACK_DEPTH, fn), number=number, repeat=REPEATS)
+    return min(timings) / number * 1e6
+
+
+def enter_exit():
+    with LoggingContext("bench", a=1):
+        pass
+
+
+@LoggingContext(user_id="user.id", tenant="tenant")
+def decorated(user, tenant, flag=False):
+    pass
+
+
+def call_decorated():
+    decorated({"id": "user-1"}, "tenant-1", flag=True)
+
+
+if __name__ == "__main__":
+    woodchipper.configure(config=Minimal, facilities={"": "WARNING"})
+    print(f"Stack depth: {STACK_DEPTH} frames")
+    print(f"Reaching the stack depth alone:              {per_call_musec(lambda: None):10.2f} musec")
+    legacy = per_call_musec(legacy_resolution_per_context, LEGACY_ITERATIONS)
+    print(f"Caller resolution, before (x2 per context):  {legacy:10.2f} musec")
+    print(f"Caller resolution, after  (x1 per context):  {per_call_musec(cached_resolve_caller):10.2f} musec")
+    with patch.object(woodchipper.context, "_resolve_caller", legacy_resolve_caller_twice):
+        before = per_call_musec(enter_exit, LEGACY_ITERATIONS)
+    print(f"Full LoggingContext enter/exit, before:      {before:10.2f} musec/context")
+    print(f"Full LoggingContext enter/exit, after:       {per_call_musec(enter_exit):10.2f} musec/context")
+    print(f"Decorated function call:                     {per_call_musec(call_decorated):10.2f} musec/call")
@@ -0,0 +1,56 @@
+# To run:
+# python benchmarks/json_renderers.py
+#
+# Compares structlog's stdlib-based JSONRenderer with each FastJSONRenderer backend that is installed, on event dicts
+# shaped like what JSONLogToStdout emits inside a FastAPI request context.
+
+import datetime
+import timeit
+import uuid
+from decimal import Decimal
+
+import structlog
+
+from woodchipper.configs import FastJSONRenderer
+
+ITERATIONS = 20_000
+
+EVENT_DICT = {
+    "http.id": str(uuid.uuid4()),
+    "http.body_size": 0,
+    "http.method": "GET",
+    "http.path": "https://api.example.com/v1/listings/8f14e45f",
+    "http.query_param.page": "2",
+    "http.query_param.include": ["offers", "pricing"],
+    **{f"http.header.x-custom-{i}": f"header value {i}" for i in range(30)},
+    "http.header.user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)",
+    "http.header.authorization": "******",
+    "tkl.tenant": "tenant-42",
+    "tkl.amount": Decimal("1049.99"),
+    "tkl.renewal_at": datetime.datetime(2024, 2, 2, 15, 44, 48, 488489, tzinfo=datetime.timezone.utc),
+    "git.sha": "0a1b2c3d4e5f",
+    "dd.trace_id": "1234567890123456789",
+    "dd.span_id": "987654321987654321",
+    "event": "Listing fetched.",
+    "level": "info",
+    "logger": "api.listings",
+    "timestamp": "2024-02-02T15:44:48.488489Z",
+    "func_name": "get_listing",
+    "lineno": 120,
+    "module": "listings",
+}
+
+
+def bench(renderer):
+    return timeit.timeit(lambda: renderer(None, "info", EVENT_DICT), number=ITERATIONS) / ITERATIONS * 1e6
+
+
+if __name__ == "__main__":
+    print(f"{'structlog JSONRenderer':<28} {bench(structlog.processors.JSONRenderer()):8.2f} musec/event")
+    for backend in FastJSONRenderer.backends:
+        try:
+            renderer = FastJSONRenderer(backend=backend, as_bytes=True)
+        except ImportError:
+            print(f"{backend:<28} {'not installed':>8}")
+            continue
+        print(f"{backend:<28} {bench(renderer):8.2f} musec/event")
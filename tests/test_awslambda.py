@@ -0,0 +1,60 @@
+from unittest.mock import patch
+
+from structlog.testing import capture_logs
+
+from woodchipper.context import logging_ctx
+from woodchipper.http import awslambda
+from woodchipper.http.awslambda import WoodchipperLambda
+from woodchipper.processors import inject_context_processor
+
+
+class FakeLambdaContext:
+    aws_request_id = "request-1"
+    function_name = "listings"
+    function_version = "$LATEST"
+    # The Lambda runtime passes the memory limit as a string
+    memory_limit_in_mb = "128"
+
+    def get_remaining_time_in_millis(self):
+        return 2_500
+
+
+def app(environ, start_response):
+    start_response("200 OK", [])
+    return [repr(logging_ctx.as_dict()).encode()]
+
+
+def invoke(chipped):
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        chipped({"lambda.context": FakeLambdaContext()}, lambda status, headers: None)
+    return next(log for log in caps_logs if log["event"] == "Exiting context: awslambda:dispatch")
+
+
+def test_lambda_outside_lambda(monkeypatch):
+    monkeypatch.delenv("LAMBDA_TASK_ROOT", raising=False)
+    chipped = WoodchipperLambda(app)
+    with capture_logs() as caps_logs:
+        assert chipped({}, lambda status, headers: None) == [b"{}"]
+    assert caps_logs == []
+
+
+def test_lambda_invocations(monkeypatch):
+    monkeypatch.setenv("LAMBDA_TASK_ROOT", "/var/task")
+    monkeypatch.setattr(awslambda, "_cold_start", True)
+    chipped = WoodchipperLambda(app)
+    # The environment is checked once, when the middleware is created
+    monkeypatch.delenv("LAMBDA_TASK_ROOT")
+
+    with patch.object(awslambda, "_process_age_musec", return_value=350_000):
+        first = invoke(chipped)
+    second = invoke(chipped)
+
+    assert first["lambda.aws-request-id"] == "request-1"
+    assert first["lambda.function-name"] == "listings"
+    assert first["lambda.cold-start"] is True
+    assert second["lambda.cold-start"] is False
+    # Every invocation reports how long the process took to get to its first one
+    assert first["lambda.init-duration-musec"] == second["lambda.init-duration-musec"] == 350_000
+    assert second["lambda.remaining-time-msec"] == 2_500
+    assert second["lambda.memory-limit-mb"] == 128
+    assert second["lambda.memory-headroom-mb"] < 128
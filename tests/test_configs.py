@@ -1,9 +1,18 @@
+import datetime
 import importlib
+import json
 import os
+import uuid
+from decimal import Decimal
 from unittest.mock import patch
 
+import pytest
+import structlog
+
 import woodchipper
 import woodchipper.configs
+from woodchipper.context import LoggingContext, PersistentContextMap
+from woodchipper.processors import ContextEventDict, lazy_inject_context_processor
 
 
 def test_log_errors_to_sentry():
@@ -40,3 +49,115 @@ def test_sentry_can_be_disabled():
     finally:
         # Restore the configs to factory defaults
         importlib.reload(woodchipper.configs)
+
+
+@pytest.mark.parametrize(argnames="backend", argvalues=woodchipper.configs.FastJSONRenderer.backends)
+def test_fast_json_renderer_backends(backend):
+    try:
+        renderer = woodchipper.configs.FastJSONRenderer(backend=backend)
+    except ImportError:
+        pytest.skip(f"{backend} is not installed")
+
+    class Unserializable:
+        def __repr__(self):
+            return "<unserializable>"
+
+    event_dict = {
+        "event": "Rendered.",
+        "amount": Decimal("1.10"),
+        "at": datetime.datetime(2024, 2, 2, 15, 44, 48, 488489),
+        "at_utc": datetime.datetime(2024, 2, 2, 15, 44, 48, tzinfo=datetime.timezone.utc),
+        "on": datetime.date(2024, 2, 2),
+        "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        "obj": Unserializable(),
+        "count": 3,
+        "unicode": "chipper 🪵",
+    }
+    expected = {
+        "event": "Rendered.",
+        "amount": "1.10",
+        "at": "2024-02-02T15:44:48.488489",
+        "at_utc": "2024-02-02T15:44:48+00:00",
+        "on": "2024-02-02",
+        "id": "12345678-1234-5678-1234-567812345678",
+        "obj": "<unserializable>",
+        "count": 3,
+        "unicode": "chipper 🪵",
+    }
+    # The documented differences between the libraries
+    if backend == "msgspec":
+        expected["at_utc"] = "2024-02-02T15:44:48Z"
+    elif backend == "ujson":
+        expected["amount"] = 1.1
+    rendered = renderer(None, "info", event_dict)
+    assert isinstance(rendered, str)
+    assert json.loads(rendered) == expected
+
+    # Values the backend refuses outright fall back to the standard library
+    assert json.loads(renderer(None, "info", {"big": 2**70})) == {"big": 2**70}
+
+
+def test_fast_json_renderer_standard_library_renders_like_structlog():
+    renderer = woodchipper.configs.FastJSONRenderer(backend="json")
+    event_dict = {"event": "Rendered.", "count": 3, "ratio": float("nan"), "unicode": "chipper 🪵"}
+    assert renderer(None, "info", event_dict) == structlog.processors.JSONRenderer()(None, "info", event_dict)
+
+
+def test_fast_json_renderer_auto_selects_backend():
+    renderer = woodchipper.configs.FastJSONRenderer(as_bytes=True)
+    installed = []
+    for backend in woodchipper.configs.FastJSONRenderer.backends:
+        try:
+            importlib.import_module(backend)
+        except ImportError:
+            continue
+        installed.append(backend)
+    # The fastest library installed is picked
+    assert renderer.backend == installed[0]
+    assert json.loads(renderer(None, "info", {"event": "Rendered."})) == {"event": "Rendered."}
+
+    with pytest.raises(ValueError):
+        woodchipper.configs.FastJSONRenderer(backend="yaml")
+
+
+def test_fast_json_renderer_renders_context_once_per_change():
+    renderer = woodchipper.configs.FastJSONRenderer(backend="json")
+
+    def render(**event):
+        return json.loads(renderer(None, "info", lazy_inject_context_processor(None, "info", event)))
+
+    with patch.object(renderer, "_dumps", wraps=renderer._dumps) as dumps:
+        with LoggingContext(_prefix=None, a=1, b="two"):
+            lines = [render(event=f"Line {i}.") for i in range(3)]
+            # One rendering of the context, and one of each event
+            assert dumps.call_count == 4
+            with LoggingContext(_prefix=None, c=3):
+                lines.append(render(event="Nested."))
+            assert dumps.call_count == 6
+
+    assert lines[:3] == [{"a": 1, "b": "two", "event": f"Line {i}."} for i in range(3)]
+    assert lines[3] == {"a": 1, "b": "two", "c": 3, "event": "Nested."}
+
+
+def test_fast_json_renderer_layers():
+    renderer = woodchipper.configs.FastJSONRenderer(backend="json")
+    persistent = PersistentContextMap({"a": 1}).set_many({"b": 2})
+    assert json.loads(renderer(None, "info", ContextEventDict({"event": "Layered."}, persistent))) == {
+        "a": 1,
+        "b": 2,
+        "event": "Layered.",
+    }
+    assert json.loads(renderer(None, "info", ContextEventDict({}, persistent))) == {"a": 1, "b": 2}
+    assert json.loads(renderer(None, "info", ContextEventDict({"event": "Bare."}, {}))) == {"event": "Bare."}
+    # Event keys replace context keys in place
+    rendered = renderer(None, "info", ContextEventDict({"a": 5, "event": "Replaced."}, persistent))
+    assert list(json.loads(rendered).items()) == [("a", 5), ("b", 2), ("event", "Replaced.")]
+
+
+def test_json_config_writes_bytes(capsysbinary):
+    woodchipper.configure(config=woodchipper.configs.JSONLogToStdout, facilities={"": "INFO"})
+    with patch("structlog_sentry.capture_event"):
+        woodchipper.get_logger("test_configs.bytes").info("Bytes all the way down.", a=1)
+    message = json.loads(capsysbinary.readouterr().out)
+    assert message["event"] == "Bytes all the way down."
+    assert message["a"] == 1
@@ -1,6 +1,15 @@
-from unittest.mock import patch
+import asyncio
+import contextvars
+import logging
+import time
+from unittest.mock import Mock, patch
 
+import pytest
+from structlog.testing import capture_logs
+
+import woodchipper
 from woodchipper import context
+from woodchipper.monitors import BaseMonitor
 
 
 def test_logging_context_var():
@@ -89,3 +98,199 @@ def test_logging_context_name():
 
     f(1)
     assert ctx_obj.name == "test_context:f"
+
+
+def test_resolve_caller_is_cached_per_code_object():
+    def caller():
+        return context._resolve_caller(0)
+
+    assert caller() == ("test_context", "test_context:caller")
+    assert context._caller_cache[caller.__code__] == ("test_context", "test_context:caller")
+
+
+def test_logging_context_var_batched_update():
+    var = context.LoggingContextVar("var")
+    var._var = Mock(wraps=contextvars.ContextVar("var", default={}))
+    tkn = var.update({f"header.{i}": i for i in range(40)})
+    assert var._var.set.call_count == 1
+    assert len(var) == 40
+    var.reset(tkn)
+    assert var == {}
+
+    with pytest.raises(ValueError):
+        var.update({})
+
+
+def test_persistent_logging_context_var():
+    var = context.LoggingContextVar("var", persistent=True)
+    assert var == {}
+
+    tkn1 = var.update(dict(a=1, b=2))
+    tkn2 = var.update(dict(a=3, c=4))
+    assert var == dict(a=3, b=2, c=4)
+    assert var["a"] == 3
+    assert var["missing"] is None
+    assert var.as_dict() == dict(a=3, b=2, c=4)
+
+    tkn3 = var.__delitem__("b")
+    assert var == dict(a=3, c=4)
+    with pytest.raises(KeyError):
+        del var["b"]
+
+    var.reset(tkn3)
+    assert var == dict(a=3, b=2, c=4)
+    var.reset(tkn2)
+    assert var == dict(a=1, b=2)
+    var.reset(tkn1)
+    assert var == {}
+
+
+def test_persistent_context_map_shares_structure():
+    base = context.PersistentContextMap({f"k{i}": i for i in range(100)})
+    layer = base
+    for i in range(context.PersistentContextMap.max_depth * 3):
+        layer = layer.set_many({f"k{i}": -i, f"new{i}": i})
+        # Each derived map only holds its own changes, until the chain is flattened
+        assert len(layer._changes) in (2, len(layer))
+        assert layer._depth <= context.PersistentContextMap.max_depth
+    assert layer["k0"] == 0
+    assert layer["k1"] == -1
+    assert layer["k99"] == 99
+    assert len(layer) == 100 + context.PersistentContextMap.max_depth * 3
+    # The base is untouched
+    assert base["k1"] == 1
+    assert len(base) == 100
+
+
+def test_logging_context_async_with():
+    async def work():
+        async with context.LoggingContext(a=1, _prefix=None) as ctx_value:
+            await asyncio.sleep(0)
+            inside = context.logging_ctx.as_dict()
+        return ctx_value, inside, context.logging_ctx.as_dict()
+
+    assert asyncio.run(work()) == (None, {"a": 1}, {})
+
+
+@pytest.fixture
+def facilities():
+    """Swap in a set of configured facility levels, set on their loggers, for the duration of a test."""
+    saved_levels = {}
+
+    def set_facilities(**levels):
+        woodchipper._facilities.clear()
+        woodchipper._facilities.update(levels)
+        for name, level in levels.items():
+            saved_levels.setdefault(name, logging.getLogger(name).level)
+            logging.getLogger(name).setLevel(level)
+
+    with patch.dict(woodchipper._facilities), patch.object(woodchipper, "_context_sinks", []):
+        yield set_facilities
+    for name, level in saved_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def test_is_enabled_for(facilities):
+    facilities(**{"": "WARNING", "app": "INFO", "app.noisy": "ERROR"})
+    assert not woodchipper.is_enabled_for("other", logging.INFO)
+    assert woodchipper.is_enabled_for("other", logging.WARNING)
+    assert woodchipper.is_enabled_for("app.views", logging.INFO)
+    assert not woodchipper.is_enabled_for("app.noisy.module", logging.WARNING)
+    assert woodchipper.is_enabled_for("app.noisy.module", logging.ERROR)
+
+    # Levels changed after configuring apply straight away
+    logging.getLogger("app.noisy").setLevel(logging.DEBUG)
+    assert woodchipper.is_enabled_for("app.noisy.module", logging.INFO)
+    logging.getLogger("app").setLevel(logging.ERROR)
+    assert not woodchipper.is_enabled_for("app.views", logging.WARNING)
+
+    # An unconfigured woodchipper emits everything
+    facilities()
+    assert woodchipper.is_enabled_for("other", logging.DEBUG)
+
+
+def test_logging_context_skips_filtered_messages(facilities):
+    facilities(**{"": "WARNING"})
+    monitor_cls = Mock()
+    with patch.object(woodchipper, "_monitors", {monitor_cls}), patch("woodchipper.get_logger") as get_logger:
+        with context.LoggingContext(a=1, _prefix=None):
+            assert context.logging_ctx.as_dict() == {"a": 1}
+    assert not get_logger.called
+    assert not monitor_cls.called
+
+    # The same context at a level that is emitted logs and runs monitors
+    with patch.object(woodchipper, "_monitors", {monitor_cls}), patch("woodchipper.get_logger") as get_logger:
+        monitor_cls.return_value.finish.return_value = {"monitor.value": 1}
+        with context.LoggingContext(a=1, _prefix=None, _log_level="WARNING"):
+            pass
+    assert get_logger.return_value.log.call_count == 2
+    assert monitor_cls.return_value.setup.called
+
+
+def test_logging_context_sinks_run_without_messages(facilities):
+    facilities(**{"": "WARNING"})
+    sink = Mock()
+    woodchipper._context_sinks.append(sink)
+    with patch("woodchipper.get_logger") as get_logger:
+        with context.LoggingContext("sunk", a=1):
+            pass
+    assert not get_logger.called
+    name, data = sink.call_args[0]
+    assert name == "sunk"
+    assert "context.time_to_run_musec" in data
+
+
+@pytest.mark.parametrize(argnames="cpu_time", argvalues=["thread", "process"])
+def test_logging_context_cpu_time(cpu_time):
+    with capture_logs() as caps_logs:
+        with context.LoggingContext("blocked", _cpu_time=cpu_time):
+            time.sleep(0.05)
+        with context.LoggingContext("computing", _cpu_time=cpu_time):
+            # Spin until the clock being measured has advanced, so that a busy machine can't starve the loop of CPU
+            clock = time.thread_time if cpu_time == "thread" else time.process_time
+            deadline = clock() + 0.05
+            while clock() < deadline:
+                pass
+        with context.LoggingContext("untimed"):
+            pass
+    blocked, computing, untimed = [log for log in caps_logs if log["event"].startswith("Exiting context")]
+
+    assert blocked["context.time_to_run_musec"] >= 50_000
+    assert blocked["context.cpu_time_musec"] < 25_000
+    assert computing["context.cpu_time_musec"] >= 25_000
+    assert isinstance(computing["context.time_to_run_musec"], int)
+    assert "context.cpu_time_musec" not in untimed
+
+    with patch.dict("woodchipper.context.os.environ", WOODCHIPPER_CONTEXT_CPU_TIME="process"):
+        assert context.LoggingContext()._cpu_clock is time.process_time_ns
+
+
+class ReusableMonitor(BaseMonitor):
+    __slots__ = ("entered",)
+
+    reusable = True
+
+    def __init__(self):
+        self.entered = False
+
+    def setup(self):
+        assert not self.entered, "Reused without being reset"
+        self.entered = True
+
+    def finish_into(self, results):
+        results["reusable.id"] = id(self)
+
+
+def test_logging_context_reuses_monitors():
+    with patch.object(woodchipper, "_monitors", {ReusableMonitor}), capture_logs() as caps_logs:
+        for _ in range(3):
+            with context.LoggingContext("sequential"):
+                pass
+        with context.LoggingContext("outer"):
+            with context.LoggingContext("inner"):
+                pass
+    exits = [log for log in caps_logs if log["event"].startswith("Exiting context")]
+    # Sequential contexts share one monitor, nested contexts need one each
+    assert len({log["reusable.id"] for log in exits[:3]}) == 1
+    assert exits[3]["reusable.id"] != exits[4]["reusable.id"]
+    assert not hasattr(ReusableMonitor(), "__dict__")
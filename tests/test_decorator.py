@@ -1,20 +1,24 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
+from unittest.mock import patch
 
 import pytest
+from structlog.testing import capture_logs
 
-from woodchipper.context import LoggingContext, missing, pluck_value
+from woodchipper.context import LoggingContext, logging_ctx, missing, pluck_value
 
 
 def test_arg_logger_invokes_logging_context_with_arguments():
-    dec = LoggingContext(Foo="foo", Bar="bar", NestedObjID="key.nested_obj.id", NestValue="nest.value")
+    dec = LoggingContext(Foo="foo", Bar="bar", NestedObjID="key.nested_obj.id", NestValue="nest.value", _prefix=None)
 
     @dec
     def foo(bar, key=None, foo="hello", **kwargs):
-        pass
+        return logging_ctx.as_dict()
 
-    foo("bar value", key={"nested_obj": {"id": "some_id"}})
-
-    assert dec.injected_context == {
+    assert foo("bar value", key={"nested_obj": {"id": "some_id"}}) == {
         "Bar": "bar value",
         "NestedObjID": "some_id",
         "NestValue": str(missing),
@@ -46,3 +50,129 @@ def test_arg_logger_invokes_logging_context_with_arguments():
 )
 def test_pluck_value(obj, path_name, delimiter, return_value):
     assert pluck_value(obj, path_name, delimiter=delimiter) == return_value
+
+
+def test_decorator_extracts_arguments_without_binding():
+    seen = []
+    dec = LoggingContext(
+        First="a",
+        Second="b.value",
+        SecondAgain="b.other",
+        KwOnly="c",
+        Rest="args",
+        Extra="kwargs.extra",
+        Unknown="nope",
+        _prefix=None,
+    )
+
+    @dec
+    def foo(a, /, b, *args, c=None, **kwargs):
+        seen.append(logging_ctx.as_dict())
+
+    with patch("woodchipper.context.inspect.signature") as mock_signature:
+        foo(1, {"value": 2, "other": 3}, 4, 5, c=6, extra=7)
+        foo(1, b={"value": 2})
+    assert not mock_signature.called
+
+    assert seen[0] == {
+        "First": 1,
+        "Second": 2,
+        "SecondAgain": 3,
+        "KwOnly": 6,
+        "Rest": "(4, 5)",
+        "Extra": 7,
+        "Unknown": str(missing),
+    }
+    assert seen[1] == {
+        "First": 1,
+        "Second": 2,
+        "SecondAgain": str(missing),
+        "KwOnly": str(missing),
+        "Rest": str(missing),
+        "Extra": str(missing),
+        "Unknown": str(missing),
+    }
+
+
+def test_decorator_without_dig_paths():
+    @LoggingContext("no-paths")
+    def foo(a):
+        return logging_ctx.as_dict()
+
+    assert foo(1) == {}
+
+
+def test_decorator_is_safe_across_threads():
+    barrier = threading.Barrier(8)
+
+    @LoggingContext(Value="value", _prefix=None)
+    def foo(value):
+        barrier.wait()
+        time.sleep(0.01)
+        return logging_ctx.as_dict()["Value"]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(foo, range(8)))
+    assert results == list(range(8))
+
+
+def exit_logs(caps_logs):
+    return [log for log in caps_logs if log["event"].startswith("Exiting context")]
+
+
+def test_decorator_on_coroutine_function():
+    @LoggingContext(Value="value", _prefix=None)
+    async def foo(value):
+        await asyncio.sleep(0.02)
+        return logging_ctx.as_dict()
+
+    with capture_logs() as caps_logs:
+        assert asyncio.run(foo(1)) == {"Value": 1}
+    assert logging_ctx.as_dict() == {}
+    # The context covers the awaited work, not just the creation of the coroutine
+    assert exit_logs(caps_logs)[0]["context.time_to_run_musec"] >= 20_000
+
+
+def test_decorator_on_async_generator_function():
+    seen_by_consumer = []
+
+    @LoggingContext(Value="value", _prefix=None)
+    async def numbers(value):
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield i, logging_ctx.as_dict()
+
+    async def consume():
+        items = []
+        async for item in numbers(1):
+            seen_by_consumer.append(logging_ctx.as_dict())
+            items.append(item)
+        return items
+
+    with capture_logs() as caps_logs:
+        items = asyncio.run(consume())
+    assert items == [(i, {"Value": 1}) for i in range(3)]
+    # The generator's context doesn't leak into the consumer between items
+    assert seen_by_consumer == [{}, {}, {}]
+    assert len(exit_logs(caps_logs)) == 1
+    assert exit_logs(caps_logs)[0]["context.time_to_run_musec"] >= 30_000
+
+
+def test_decorator_on_async_generator_function_closed_early():
+    @LoggingContext(Value="value", _prefix=None)
+    async def numbers(value):
+        try:
+            while True:
+                yield logging_ctx.as_dict()
+        finally:
+            assert logging_ctx.as_dict() == {"Value": 1}
+
+    async def consume():
+        agen = numbers(1)
+        first = await agen.__anext__()
+        await agen.aclose()
+        return first
+
+    with capture_logs() as caps_logs:
+        assert asyncio.run(consume()) == {"Value": 1}
+    assert len(exit_logs(caps_logs)) == 1
@@ -1,15 +1,21 @@
 import ast
+import asyncio
+import contextlib
 import logging
 from unittest.mock import patch
 
 import pytest
-from fastapi import FastAPI, testclient
+from fastapi import FastAPI, WebSocket, testclient
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
+from structlog.testing import capture_logs
 
 import woodchipper
 from woodchipper.configs import DevLogToStdout
 from woodchipper.context import LoggingContext, logging_ctx
+from woodchipper.http import MAX_CACHED_NAMES, ContextKeys
 from woodchipper.http.fastapi import WoodchipperFastAPI
+from woodchipper.processors import inject_context_processor
 
 
 @pytest.fixture
@@ -189,3 +195,171 @@ def test_alternate_installation(caplog):
     ), "An exit message matching the fastapi:request pattern couldn't be found"
     assert fastapi_colon_request_exit_log["http.response.status_code"] == 200
     assert type(fastapi_colon_request_exit_log["http.response.content_length"]) is int
+
+
+def test_fastapi_header_allowlist():
+    app = FastAPI()
+    WoodchipperFastAPI(
+        app, allowed_headers=["Host", "X-Tenant", "X-Ignored"], ignored_headers=["x-ignored"]
+    ).chipperize()
+    client = testclient.TestClient(app)
+
+    @app.get("/")
+    def hello():
+        return logging_ctx.as_dict()
+
+    response = client.get("/", headers={"X-Tenant": "tenant-1", "X-Ignored": "1", "X-Other": "1"})
+
+    assert response.status_code == 200
+    headers = {key: value for key, value in response.json().items() if key.startswith("http.header.")}
+    assert headers == {"http.header.host": "testserver", "http.header.x-tenant": "tenant-1"}
+
+
+def test_context_keys_cache_is_bounded():
+    keys = ContextKeys("header.", masked=["Authorization"])
+    assert keys.lookup(b"authorization") == ("header.authorization", True)
+    assert keys.lookup("X-Custom") == ("header.x-custom", False)
+    for i in range(MAX_CACHED_NAMES + 10):
+        assert keys.lookup(f"x-{i}") == (f"header.x-{i}", False)
+    assert len(keys._cache) == MAX_CACHED_NAMES
+
+
+def test_fastapi_streaming_metrics():
+    app = FastAPI()
+    WoodchipperFastAPI(app, streaming_metrics=True).chipperize()
+    client = testclient.TestClient(app)
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"a" * 10, b"b" * 20, b"c" * 30]))
+
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        response = client.get("/stream")
+
+    assert response.status_code == 200
+    exit_log = next(log for log in caps_logs if log["event"] == "Exiting context: fastapi:request")
+    assert exit_log["http.response.status_code"] == 200
+    assert exit_log["http.response.body_bytes"] == 60
+    assert exit_log["http.response.ttfb_musec"] <= exit_log["context.time_to_run_musec"]
+    assert exit_log["http.response.disconnected"] is False
+    assert exit_log["http.response.cancelled"] is False
+
+
+def test_fastapi_streaming_metrics_disconnect():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"data: 1\n\n", "more_body": True})
+        assert (await receive())["type"] == "http.disconnect"
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/events", "headers": [], "query_string": b""}
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        asyncio.run(WoodchipperFastAPI(app, streaming_metrics=True)(scope, receive, send))
+
+    exit_log = next(log for log in caps_logs if log["event"] == "Exiting context: fastapi:request")
+    assert exit_log["http.response.disconnected"] is True
+    assert exit_log["http.response.body_bytes"] == 9
+    assert exit_log["http.path"] == "/events"
+
+
+def test_fastapi_websocket_session():
+    app = FastAPI()
+    WoodchipperFastAPI(app, websockets=True, websocket_message_sample_rate=2).chipperize()
+
+    @app.websocket("/ws")
+    async def echo(websocket: WebSocket):
+        await websocket.accept()
+        for _ in range(3):
+            text = await websocket.receive_text()
+            logging.getLogger(__name__).info("Handling message.")
+            await websocket.send_text(text * 2)
+        await websocket.close(code=1001)
+
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        with TestClient(app).websocket_connect("/ws") as websocket:
+            for text in ("a", "bb", "ccc"):
+                websocket.send_text(text)
+                websocket.receive_text()
+
+    exit_log = next(log for log in caps_logs if log["event"] == "Exiting context: fastapi:websocket")
+    assert exit_log["websocket.path"] == "ws://testserver/ws"
+    assert exit_log["websocket.accepted"] is True
+    assert exit_log["websocket.messages_received"] == 3
+    assert exit_log["websocket.bytes_received"] == 6
+    assert exit_log["websocket.messages_sent"] == 3
+    assert exit_log["websocket.bytes_sent"] == 12
+    assert exit_log["websocket.close_code"] == 1001
+    # The first and third messages are sampled
+    message_logs = [log for log in caps_logs if log["event"] == "WebSocket message received."]
+    assert [log["websocket.message.index"] for log in message_logs] == [1, 3]
+    assert [log["websocket.message.bytes"] for log in message_logs] == [1, 3]
+    assert all(log["websocket.id"] == exit_log["websocket.id"] for log in message_logs)
+
+
+def test_fastapi_websocket_reader_task():
+    messages = [{"type": "websocket.connect"}]
+    messages += [{"type": "websocket.receive", "text": text} for text in ("a", "bb", "ccc")]
+    messages += [{"type": "websocket.disconnect", "code": 1000}]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    async def app(scope, receive, send):
+        assert (await receive())["type"] == "websocket.connect"
+        await send({"type": "websocket.accept"})
+
+        async def reader():
+            while True:
+                with LoggingContext("reading", _prefix=None, **{"reader.id": 1}):
+                    message = await receive()
+                    woodchipper.get_logger(__name__).info("Read.")
+                assert "reader.id" not in logging_ctx.as_dict()
+                if message["type"] == "websocket.disconnect":
+                    return
+
+        await asyncio.create_task(reader())
+
+    headers = [(b"host", b"testserver"), (b"content-length", b"12")]
+    scope = {"type": "websocket", "path": "/ws", "headers": headers, "scheme": "ws"}
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        asyncio.run(WoodchipperFastAPI(app, websockets=True, websocket_message_sample_rate=2)(scope, receive, send))
+
+    exit_log = next(log for log in caps_logs if log["event"] == "Exiting context: fastapi:websocket")
+    assert exit_log["websocket.messages_received"] == 3
+    assert exit_log["websocket.close_code"] == 1000
+    # A content-length header on the handshake is not a body size
+    assert "http.body_size" not in exit_log
+    # The app's own context around receiving a message is left alone
+    read_logs = [log for log in caps_logs if log["event"] == "Read."]
+    assert len(read_logs) == 4
+    assert all(log["reader.id"] == 1 for log in read_logs)
+    message_logs = [log for log in caps_logs if log["event"] == "WebSocket message received."]
+    assert [log["websocket.message.index"] for log in message_logs] == [1, 3]
+    assert all(log["reader.id"] == 1 and log["websocket.id"] == exit_log["websocket.id"] for log in message_logs)
+
+
+def test_fastapi_lifespan_durations():
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        await asyncio.sleep(0.01)
+        yield
+
+    app = FastAPI(lifespan=lifespan)
+    WoodchipperFastAPI(app, lifespan=True).chipperize()
+
+    with capture_logs() as caps_logs:
+        with TestClient(app):
+            pass
+
+    startup_log = next(log for log in caps_logs if log["event"] == "Lifespan startup complete.")
+    assert startup_log["lifespan.startup_musec"] >= 10_000
+    shutdown_log = next(log for log in caps_logs if log["event"] == "Lifespan shutdown complete.")
+    assert shutdown_log["lifespan.shutdown_musec"] >= 0
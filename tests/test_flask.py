@@ -5,9 +5,11 @@ from unittest.mock import patch
 from urllib.parse import urlencode
 
 from flask import Flask
+from structlog.testing import capture_logs
 
 from woodchipper.context import LoggingContext, logging_ctx
 from woodchipper.http.flask import WoodchipperFlask
+from woodchipper.processors import inject_context_processor
 
 app = Flask(__name__)
 WoodchipperFlask(app).chipperize()
@@ -109,3 +111,57 @@ def test_flask_with_woodchipper_adds_query_params():
     assert response_json["http.query_param.key3"] == "value3"
     assert response_json["http.query_param.key4"] == ""
     assert response_json["http.path"] == "http://localhost/"  # confirms that querystring isn't included
+
+
+def make_app(**kwargs):
+    app = Flask(__name__)
+    WoodchipperFlask(app, **kwargs).chipperize()
+
+    @app.route("/")
+    def context():
+        return logging_ctx.as_dict()
+
+    @app.route("/health")
+    def health():
+        return logging_ctx.as_dict()
+
+    @app.route("/internal/metrics")
+    def metrics():
+        return logging_ctx.as_dict()
+
+    @app.route("/fail")
+    def fail():
+        raise ValueError("oh no!")
+
+    return app
+
+
+def test_flask_excluded_requests():
+    app = make_app(excluded_paths=[r"/internal/.*"], excluded_endpoints=["health"])
+    with app.test_client() as client:
+        assert json.loads(client.get("/health").data) == {}
+        assert json.loads(client.get("/internal/metrics").data) == {}
+        assert json.loads(client.get("/").data)["http.method"] == "GET"
+
+
+def test_flask_header_allowlist():
+    app = make_app(allowed_headers=["Host", "X-Tenant", "X-Ignored"], ignored_headers=["x-ignored"])
+    with app.test_client() as client:
+        response = client.get("/", headers={"X-Tenant": "tenant-1", "X-Ignored": "1", "X-Other": "1"})
+    headers = {key: value for key, value in json.loads(response.data).items() if key.startswith("http.header.")}
+    assert headers == {"http.header.host": "localhost", "http.header.x-tenant": "tenant-1"}
+
+
+def test_flask_defer_headers():
+    app = make_app(defer_headers=True, blacklisted_headers=["x-secret"])
+    with app.test_client() as client:
+        response = client.get("/", headers={"X-Tenant": "tenant-1"})
+        assert not any(key.startswith("http.header.") for key in json.loads(response.data))
+
+        with capture_logs(processors=[inject_context_processor]) as caps_logs:
+            client.get("/fail", headers={"X-Tenant": "tenant-1", "X-Secret": "hunter2"})
+
+    exit_log = next(log for log in caps_logs if log["event"] == "Exiting context: flask:request")
+    assert exit_log["http.response.status_code"] == 500
+    assert exit_log["http.header.x-tenant"] == "tenant-1"
+    assert exit_log["http.header.x-secret"] == "******"
@@ -0,0 +1,258 @@
+import contextlib
+import io
+import json
+import logging
+import threading
+import time
+
+import pytest
+
+import woodchipper
+from woodchipper.configs import Minimal
+from woodchipper.context import LoggingContext, logging_ctx
+from woodchipper.handlers import HeldRecord, QueueingStreamHandler, TailBuffer, dropped_record_count
+from woodchipper.processors import lazy_inject_context_processor
+
+
+class BlockingStream(io.StringIO):
+    """A stream whose writes wait until released, to simulate stdout backpressure."""
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, s):
+        self.released.wait()
+        return super().write(s)
+
+
+def make_record(msg):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, None, None)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class ContextualMinimal(Minimal):
+    processors = Minimal.processors + [lazy_inject_context_processor]
+
+
+def test_queueing_handler_writes_in_background():
+    stream = io.StringIO()
+    handler = QueueingStreamHandler(stream)
+    for i in range(100):
+        handler.handle(make_record(f"message {i}"))
+    handler.flush()
+    assert stream.getvalue().splitlines() == [f"message {i}" for i in range(100)]
+    handler.close()
+
+    # Records handled after closing are written synchronously
+    handler.handle(make_record("after close"))
+    assert stream.getvalue().splitlines()[-1] == "after close"
+
+
+def test_queueing_handler_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        QueueingStreamHandler(io.StringIO(), overflow="explode")
+
+
+@pytest.mark.parametrize(
+    argnames=["overflow", "expected"],
+    argvalues=[
+        # The first record is picked up by the background thread and stuck writing; two more fit in the queue
+        ("drop_newest", ["message 0", "message 1", "message 2"]),
+        ("drop_oldest", ["message 0", "message 8", "message 9"]),
+    ],
+)
+def test_queueing_handler_overflow(overflow, expected):
+    stream = BlockingStream()
+    handler = QueueingStreamHandler(stream, queue_size=2, overflow=overflow)
+    handler.handle(make_record("message 0"))
+    while not handler.queue.empty():
+        pass
+    dropped_before = dropped_record_count()
+    for i in range(1, 10):
+        handler.handle(make_record(f"message {i}"))
+    assert handler.dropped_count == 7
+    assert dropped_record_count() - dropped_before == 7
+
+    stream.released.set()
+    handler.close()
+    assert stream.getvalue().splitlines() == expected
+
+
+def test_configure_with_queue():
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        woodchipper.configure(config=Minimal, facilities={"": "INFO"}, use_queue=True)
+        logger = woodchipper.get_logger("test_handlers.queued")
+        for i in range(10):
+            logger.info("Queued message.", i=i)
+        # Resetting drains the queue
+        woodchipper.reset()
+    messages = [json.loads(message) for message in buf.getvalue().strip().split("\n")]
+    assert [message["i"] for message in messages] == list(range(10))
+
+
+def run_tail_sampled(body, config=Minimal, **kwargs):
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        woodchipper.configure(config=config, facilities={"": "INFO"})
+        # Configuring disables the loggers created by earlier tests
+        for name in (__name__, "test_handlers.tail", "test_handlers.tail_stdlib"):
+            logging.getLogger(name).disabled = False
+        logger = woodchipper.get_logger("test_handlers.tail")
+        try:
+            with LoggingContext("tail", _tail_sampling=True, **kwargs):
+                body(logger)
+        except RuntimeError:
+            pass
+    return [json.loads(message) for message in buf.getvalue().strip().split("\n")]
+
+
+def test_tail_sampling_discards_healthy_contexts():
+    def body(logger):
+        logger.info("Step one.")
+        logging.getLogger("test_handlers.tail_stdlib").warning("Step two.")
+
+    messages = run_tail_sampled(body)
+    assert [message["event"] for message in messages] == ["Exiting context: tail"]
+    assert messages[0]["context.tail_sampling"] == "discarded"
+    # The entrance message is held back too
+    assert messages[0]["context.tail_buffered_count"] == 3
+
+
+def fail(logger):
+    logger.info("Step one.")
+    raise RuntimeError()
+
+
+def server_error(logger):
+    logger.info("Step one.")
+    logging_ctx.update({"http.response.status_code": 503})
+
+
+def slow(logger):
+    logger.info("Step one.")
+    time.sleep(0.01)
+
+
+@pytest.mark.parametrize(
+    argnames=["body", "kwargs"],
+    argvalues=[(fail, {}), (server_error, {}), (slow, {"_tail_slow_musec": 5_000})],
+)
+def test_tail_sampling_keeps_failed_contexts(body, kwargs):
+    messages = run_tail_sampled(body, **kwargs)
+    assert [message["event"] for message in messages] == [
+        "Entering context: tail",
+        "Step one.",
+        "Exiting context: tail",
+    ]
+    assert messages[-1]["context.tail_sampling"] == "kept"
+
+
+def test_tail_sampling_nested_contexts():
+    def body(logger):
+        logger.info("Outer step.")
+        try:
+            with LoggingContext("inner", _tail_sampling=True):
+                logger.info("Inner step.")
+                raise ValueError()
+        except ValueError:
+            pass
+        with LoggingContext("healthy", _tail_sampling=True):
+            logger.info("Healthy step.")
+
+    messages = run_tail_sampled(body)
+    # The failed inner context keeps every message of the enclosing context, including the healthy context's
+    assert [message["event"] for message in messages] == [
+        "Entering context: tail",
+        "Outer step.",
+        "Entering context: inner",
+        "Inner step.",
+        "Exiting context: inner",
+        "Entering context: healthy",
+        "Healthy step.",
+        "Exiting context: healthy",
+        "Exiting context: tail",
+    ]
+    assert [message["context.tail_sampling"] for message in messages if "context.tail_sampling" in message] == [
+        "deferred",
+        "deferred",
+        "kept",
+    ]
+
+
+def test_tail_sampling_failing_outer_context_keeps_healthy_inner_context():
+    def body(logger):
+        with LoggingContext("inner", _tail_sampling=True):
+            logger.info("Inner step.")
+        raise RuntimeError()
+
+    messages = run_tail_sampled(body)
+    assert [message["event"] for message in messages] == [
+        "Entering context: tail",
+        "Entering context: inner",
+        "Inner step.",
+        "Exiting context: inner",
+        "Exiting context: tail",
+    ]
+
+
+def test_tail_sampling_healthy_nested_contexts_are_discarded():
+    def body(logger):
+        with LoggingContext("inner", _tail_sampling=True):
+            logger.info("Inner step.")
+
+    messages = run_tail_sampled(body)
+    assert [message["event"] for message in messages] == ["Exiting context: tail"]
+    # The inner context's entrance, step and exit messages are held back along with the outer entrance message
+    assert messages[0]["context.tail_buffered_count"] == 4
+
+
+def test_tail_sampling_stdlib_records_keep_their_context():
+    def body(logger):
+        with LoggingContext("inner", _tail_sampling=True, _prefix=None, b=3):
+            logging.getLogger("test_handlers.tail_stdlib").info("Inner step.")
+        logging_ctx.update({"http.response.status_code": 503})
+
+    messages = run_tail_sampled(body, config=ContextualMinimal, _prefix=None, a=2)
+    step = next(message for message in messages if message["event"] == "Inner step.")
+    # The context is added to standard library records when they are formatted, on release, but is the one they were
+    # logged in
+    assert step["a"] == 2
+    assert step["b"] == 3
+    assert "http.response.status_code" not in step
+
+
+def test_tail_sampling_releases_records_through_the_filtered_handler():
+    other_handler = ListHandler()
+    stdlib_logger = logging.getLogger("test_handlers.tail_stdlib")
+    stdlib_logger.addHandler(other_handler)
+
+    def body(logger):
+        stdlib_logger.warning("Step one.")
+        raise RuntimeError()
+
+    try:
+        messages = run_tail_sampled(body)
+    finally:
+        stdlib_logger.removeHandler(other_handler)
+    assert "Step one." in [message["event"] for message in messages]
+    # Handlers that never held the record back don't get it again
+    assert [record.msg for record in other_handler.records] == ["Step one."]
+
+
+def test_tail_buffer_overflow(monkeypatch):
+    monkeypatch.setattr(TailBuffer, "max_records", 2)
+    buffer = TailBuffer()
+    for i in range(5):
+        buffer.add(HeldRecord(ListHandler(), make_record(f"message {i}"), {}))
+    assert buffer.overflow_count == 3
+    assert [held.record.msg for held in buffer.records] == ["message 3", "message 4"]
@@ -0,0 +1,119 @@
+import asyncio
+import http.server
+import threading
+from unittest.mock import patch
+
+import httpx
+import pytest
+import requests
+from structlog.testing import capture_logs
+
+import woodchipper
+from woodchipper.context import LoggingContext
+from woodchipper.monitors import httpclient
+from woodchipper.monitors.httpclient import HTTPClientMonitor
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = 500 if self.path == "/error" else 200
+        body = b"x" * 100
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_client_monitor(server_url):
+    monitor = HTTPClientMonitor()
+    monitor.setup()
+    requests.get(f"{server_url}/")
+    requests.post(f"{server_url}/", data=b"y" * 10)
+    requests.get(f"{server_url}/error")
+    with httpx.Client() as client:
+        client.get(f"{server_url}/")
+        client.post(f"{server_url}/", content=b"y" * 20)
+    with pytest.raises(requests.ConnectionError):
+        # Nothing listens on the discard port
+        requests.get("http://localhost:9/")
+    results = monitor.finish()
+
+    assert results["http_client.call_count"] == 6
+    assert results["http_client.error_count"] == 2
+    assert results["http_client.host.127.0.0.1.call_count"] == 5
+    assert results["http_client.host.127.0.0.1.error_count"] == 1
+    assert results["http_client.host.127.0.0.1.bytes_sent"] == 30
+    assert results["http_client.host.127.0.0.1.bytes_received"] == 300
+    assert results["http_client.host.127.0.0.1.max_time_musec"] > 0
+    assert results["http_client.host.localhost.error_count"] == 1
+
+    # Calls after the context has finished are not counted
+    requests.get(f"{server_url}/")
+    assert monitor.finish()["http_client.call_count"] == 6
+
+
+def test_http_client_monitor_async_tasks(server_url):
+    async def call(count):
+        monitor = HTTPClientMonitor()
+        monitor.setup()
+        async with httpx.AsyncClient() as client:
+            for _ in range(count):
+                await client.get(f"{server_url}/")
+        return monitor.finish()["http_client.call_count"]
+
+    async def main():
+        return await asyncio.gather(call(1), call(2), call(3))
+
+    assert asyncio.run(main()) == [1, 2, 3]
+
+
+def test_http_client_monitor_bounds_hosts(monkeypatch):
+    monkeypatch.setattr(HTTPClientMonitor, "max_hosts", 2)
+    monitor = HTTPClientMonitor()
+    for host in ("a", "b", "c", "d"):
+        monitor._record_call(host, 1000, 0, 0, False)
+    results = monitor.finish()
+    assert results["http_client.call_count"] == 4
+    assert results["http_client.host.other.call_count"] == 2
+    assert "http_client.host.c.call_count" not in results
+
+
+def test_http_client_monitor_async_generator(server_url):
+    active_in_consumer = []
+
+    @LoggingContext("pages")
+    async def pages(client):
+        for _ in range(3):
+            yield (await client.get(f"{server_url}/")).status_code
+
+    async def consume():
+        async with httpx.AsyncClient() as client:
+            async for _ in pages(client):
+                active_in_consumer.append(httpclient._active_monitors.get())
+                # The consumer's own calls are not charged to the generator's context
+                await client.get(f"{server_url}/")
+
+    with patch.object(woodchipper, "_monitors", {HTTPClientMonitor}), capture_logs() as caps_logs:
+        asyncio.run(consume())
+
+    assert active_in_consumer == [(), (), ()]
+    exit_log = next(log for log in caps_logs if log["event"] == "Exiting context: pages")
+    assert exit_log["http_client.call_count"] == 3
@@ -1,7 +1,23 @@
+import contextlib
+import io
+import json
 import logging
+import os
 from unittest.mock import patch
 
-from woodchipper.processors import inject_context_processor
+import structlog
+
+import woodchipper
+from woodchipper import context
+from woodchipper.configs import Minimal
+from woodchipper.context import LoggingContext
+from woodchipper.processors import (
+    GitVersionProcessor,
+    SamplingProcessor,
+    inject_context_processor,
+    lazy_inject_context_processor,
+    materialize_context_processor,
+)
 
 mock_context_items = {
     "type": "info",
@@ -11,6 +27,10 @@ mock_context_items = {
 }
 
 
+class LazyMinimal(Minimal):
+    processors = Minimal.processors + [lazy_inject_context_processor]
+
+
 class TestInjectContextProcessor:
     @patch("woodchipper.context.logging_ctx.as_dict", return_value=mock_context_items)
     def test_updates_context_with_event(self, context_items):
@@ -30,3 +50,135 @@ class TestInjectContextProcessor:
 
         assert result["new_key"] == event_msg["new_key"]
         assert result["test_key_1"] == mock_context_items["test_key_1"]
+
+
+class TestLazyInjectContextProcessor:
+    def test_layers_event_over_context(self):
+        with LoggingContext(test_key_1="test_value_1", type="info", _prefix=None):
+            result = lazy_inject_context_processor(logging.getLogger(), "info", event_dict={"type": "debug"})
+            # The context itself is referenced, not copied
+            assert result.maps[1] is context.logging_ctx.snapshot()
+
+        assert result["type"] == "debug"
+        assert result["test_key_1"] == "test_value_1"
+        result["new_key"] = "new_value"
+        assert "new_key" not in result.maps[1]
+
+        materialized = materialize_context_processor(logging.getLogger(), "info", result)
+        assert type(materialized) is dict
+        assert materialized == {"test_key_1": "test_value_1", "type": "debug", "new_key": "new_value"}
+        assert list(materialized) == ["test_key_1", "type", "new_key"]
+        assert repr(result) == repr(materialized)
+
+    def test_renders_through_configure(self):
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            woodchipper.configure(config=LazyMinimal, facilities={"": "INFO"})
+            with LoggingContext(a=1, _prefix="ctx", _log_level="DEBUG"):
+                woodchipper.get_logger("test_processors.lazy").info("Message one.", b=2)
+        message = json.loads(buf.getvalue().strip())
+        assert message["event"] == "Message one."
+        assert message["ctx.a"] == 1
+        assert message["b"] == 2
+
+
+class TestGitVersionProcessor:
+    def test_reads_file_once(self, tmp_path):
+        version_json = tmp_path / "version.json"
+        version_json.write_text(json.dumps({"sha": "abc123"}))
+        processor = GitVersionProcessor(str(version_json))
+
+        assert processor(logging.getLogger(), "info", {})["git.sha"] == "abc123"
+        with patch("builtins.open") as mock_open:
+            assert processor(logging.getLogger(), "info", {})["git.sha"] == "abc123"
+        assert not mock_open.called
+
+    def test_check_mtime_reloads_changed_file(self, tmp_path):
+        version_json = tmp_path / "version.json"
+        version_json.write_text(json.dumps({"sha": "abc123"}))
+        processor = GitVersionProcessor(str(version_json), check_mtime=True)
+        assert processor(logging.getLogger(), "info", {})["git.sha"] == "abc123"
+
+        version_json.write_text(json.dumps({"sha": "def456"}))
+        os.utime(version_json, ns=(0, 0))
+        assert processor(logging.getLogger(), "info", {})["git.sha"] == "def456"
+
+    def test_refresh_interval(self, tmp_path):
+        version_json = tmp_path / "version.json"
+        processor = GitVersionProcessor(str(version_json), refresh_interval=60, cache_missing=True)
+        assert processor(logging.getLogger(), "info", {}) == {}
+
+        # The missing file is cached until the interval elapses
+        version_json.write_text(json.dumps({"sha": "abc123"}))
+        assert processor(logging.getLogger(), "info", {}) == {}
+        processor._checked_at -= 60
+        assert processor(logging.getLogger(), "info", {})["git.sha"] == "abc123"
+
+    def test_missing_file_not_cached_by_default(self, tmp_path):
+        version_json = tmp_path / "version.json"
+        processor = GitVersionProcessor(str(version_json))
+        assert processor(logging.getLogger(), "info", {}) == {}
+        version_json.write_text(json.dumps({"sha": "abc123"}))
+        assert processor(logging.getLogger(), "info", {})["git.sha"] == "abc123"
+
+    def test_environment_override(self, tmp_path):
+        with patch.dict(os.environ, WOODCHIPPER_GIT_VERSION='{"sha": "fromenv"}'):
+            processor = GitVersionProcessor(str(tmp_path / "version.json"), check_mtime=True)
+        with patch("woodchipper.processors.os.stat") as mock_stat, patch("builtins.open") as mock_open:
+            assert processor(logging.getLogger(), "info", {}) == {"git.sha": "fromenv"}
+        assert not mock_stat.called
+        assert not mock_open.called
+
+
+class TestSamplingProcessor:
+    logger = logging.getLogger("test_processors.sampled")
+
+    def process(self, processor, event, method="info", **kw):
+        try:
+            return processor(self.logger, method, {"event": event, **kw})
+        except structlog.DropEvent:
+            return None
+
+    def test_head_sampling(self):
+        processor = SamplingProcessor(sample_rate=3)
+        kept = [self.process(processor, "Repeated.", i=i) for i in range(7)]
+        assert [event["i"] for event in kept if event] == [0, 3, 6]
+        # Keys are sampled independently
+        assert self.process(processor, "Other.")
+
+    def test_rate_limit(self):
+        processor = SamplingProcessor(rate=10, burst=2)
+        with patch("woodchipper.processors.time.monotonic", return_value=100.0):
+            assert [bool(self.process(processor, "Limited.")) for _ in range(3)] == [True, True, False]
+        with patch("woodchipper.processors.time.monotonic", return_value=100.2):
+            assert [bool(self.process(processor, "Limited.")) for _ in range(3)] == [True, True, False]
+
+    def test_always_keep(self):
+        processor = SamplingProcessor(
+            sample_rate=1000, keep_values={"tenant": {"flagged"}}, keep_if=lambda method, event: "keep" in event
+        )
+        assert self.process(processor, "Sampled.")
+        assert not self.process(processor, "Sampled.")
+        assert self.process(processor, "Sampled.", method="error")
+        assert self.process(processor, "Sampled.", keep=True)
+        assert self.process(processor, "Sampled.", tenant="flagged")
+        with LoggingContext(tenant="flagged", _prefix=None):
+            assert self.process(processor, "Sampled.")
+        # Messages from the standard library can't be dropped in foreign_pre_chain
+        assert self.process(processor, "Sampled.", _from_structlog=False)
+
+    def test_summary_through_configure(self):
+        class SampledMinimal(Minimal):
+            processors = [SamplingProcessor(sample_rate=10, summary_interval=0)] + Minimal.processors
+
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            woodchipper.configure(config=SampledMinimal, facilities={"": "INFO"})
+            logger = woodchipper.get_logger("test_processors.summarized")
+            for i in range(11):
+                logger.info("Sampled.", i=i)
+        messages = [json.loads(line) for line in buf.getvalue().splitlines()]
+        assert [message["event"] for message in messages] == ["Sampled.", "Suppressed log messages.", "Sampled."]
+        assert messages[1]["sampling.suppressed_count"] == 9
+        assert messages[1]["sampling.top_suppressed"] == {"test_processors.summarized:Sampled.": 9}
+        assert messages[2]["i"] == 10
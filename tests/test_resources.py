@@ -0,0 +1,45 @@
+import gc
+import sys
+import tracemalloc
+
+import pytest
+
+from woodchipper.monitors.resources import ResourceMonitor
+
+
+def test_resource_monitor():
+    monitor = ResourceMonitor()
+    monitor.setup()
+    gc.collect()
+    gc.collect()
+    results = monitor.finish()
+
+    assert results["resources.gc_collections"] >= 2
+    assert results["resources.gc_pause_musec"] >= 0
+    if sys.platform == "linux":
+        assert isinstance(results["resources.rss_delta_kib"], int)
+        assert results["resources.voluntary_context_switches"] >= 0
+        assert results["resources.involuntary_context_switches"] >= 0
+    assert "resources.traced_peak_kib" not in results
+
+
+@pytest.mark.skipif(not hasattr(tracemalloc, "reset_peak"), reason="Needs tracemalloc.reset_peak")
+def test_resource_monitor_traces_allocations(monkeypatch):
+    monkeypatch.setattr(ResourceMonitor, "trace_allocations", True)
+    try:
+        outer = ResourceMonitor()
+        outer.setup()
+        data = bytearray(4 * 1024 * 1024)
+        del data
+        inner = ResourceMonitor()
+        inner.setup()
+        data = bytearray(1024 * 1024)
+        del data
+        inner_results = inner.finish()
+        outer_results = outer.finish()
+    finally:
+        tracemalloc.stop()
+
+    assert 1024 <= inner_results["resources.traced_peak_kib"] < 4096
+    # The outer context's peak was reached before the inner context started
+    assert outer_results["resources.traced_peak_kib"] >= 4096
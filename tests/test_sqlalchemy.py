@@ -1,9 +1,18 @@
+import threading
+
+import pytest
 import sqlalchemy
+from sqlalchemy import event
 
 import woodchipper
 from woodchipper.configs import DevLogToStdout
 from woodchipper.context import LoggingContext
-from woodchipper.monitors.sqlalchemy import SQLAlchemyMonitor
+from woodchipper.monitors.sqlalchemy import (
+    SQLAlchemyMonitor,
+    SQLAlchemyPoolMonitor,
+    _handle_after_cursor_execute,
+    fingerprint_statement,
+)
 
 engine = sqlalchemy.create_engine("sqlite:///:memory:")
 
@@ -23,3 +32,167 @@ def test_sqlalchemy():
             rows = conn.execute("SELECT 1")
             logger.info("SQL result.", row=rows.fetchone())
     # FIXME: Actually test something here
+
+
+def execute(count):
+    with engine.connect() as conn:
+        for _ in range(count):
+            conn.execute(sqlalchemy.text("SELECT 1")).fetchone()
+
+
+def test_sqlalchemy_monitor_counts_statements():
+    outer = SQLAlchemyMonitor()
+    outer.setup()
+    execute(2)
+    inner = SQLAlchemyMonitor()
+    inner.setup()
+    execute(3)
+    inner_result = inner.finish()
+    execute(1)
+    outer_result = outer.finish()
+    execute(1)
+
+    assert inner_result["sql.statement_count"] == 3
+    assert outer_result["sql.statement_count"] == 6
+    assert outer_result["sql.total_db_time_musec"] >= inner_result["sql.total_db_time_musec"]
+    # Listeners are registered once, not per monitor
+    assert event.contains(engine, "after_cursor_execute", _handle_after_cursor_execute)
+
+
+def test_sqlalchemy_monitor_is_isolated_per_thread():
+    results = {}
+    barrier = threading.Barrier(4)
+
+    def run(count):
+        monitor = SQLAlchemyMonitor()
+        monitor.setup()
+        barrier.wait()
+        execute(count)
+        barrier.wait()
+        results[count] = monitor.finish()["sql.statement_count"]
+
+    threads = [threading.Thread(target=run, args=(count,)) for count in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {1: 1, 2: 2, 3: 3, 4: 4}
+
+
+def test_sqlalchemy_monitor_failed_statement():
+    monitor = SQLAlchemyMonitor()
+    monitor.setup()
+    with engine.connect() as conn:
+        try:
+            conn.execute(sqlalchemy.text("SELECT * FROM no_such_table"))
+        except sqlalchemy.exc.OperationalError:
+            pass
+        conn.execute(sqlalchemy.text("SELECT 1")).fetchone()
+        assert conn.info["woodchipper_query_start"] == []
+    assert monitor.finish()["sql.statement_count"] == 1
+
+
+@pytest.mark.parametrize(
+    argnames=["statement", "expected"],
+    argvalues=[
+        ("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'it''s'", "SELECT * FROM t WHERE id IN (...) AND name = ?"),
+        (
+            "SELECT a FROM t2 WHERE x = :x_1 AND y = %(y)s -- comment\n LIMIT 10",
+            "SELECT a FROM t2 WHERE x = ? AND y = ? LIMIT ?",
+        ),
+        ("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)", "INSERT INTO t (a, b) VALUES (?, ?), ..."),
+        (
+            "SELECT col1::text FROM tab9 WHERE v > -3.5e2 AND id IN ($1, $2)",
+            "SELECT col1::text FROM tab9 WHERE v > ? AND id IN (...)",
+        ),
+    ],
+)
+def test_fingerprint_statement(statement, expected):
+    assert fingerprint_statement(statement) == expected
+
+
+def test_sqlalchemy_monitor_fingerprints(monkeypatch):
+    monkeypatch.setattr(SQLAlchemyMonitor, "fingerprint_statements", True)
+    monkeypatch.setattr(SQLAlchemyMonitor, "max_fingerprints", 3)
+    monitor = SQLAlchemyMonitor()
+    monitor.setup()
+    with engine.connect() as conn:
+        for i in range(12):
+            conn.execute(sqlalchemy.text(f"SELECT {i}")).fetchone()
+        conn.execute(sqlalchemy.text("SELECT 'a', 'b'")).fetchone()
+        conn.execute(sqlalchemy.text("SELECT 1 WHERE 1 IN (1, 2)")).fetchone()
+        conn.execute(sqlalchemy.text("SELECT 1 WHERE 1 IN (1, 2, 3)")).fetchone()
+        # A fourth fingerprint doesn't fit
+        conn.execute(sqlalchemy.text("SELECT 1 UNION SELECT 2")).fetchone()
+    results = monitor.finish()
+
+    assert results["sql.statement_count"] == 16
+    assert results["sql.fingerprint_count"] == 3
+    assert results["sql.untracked_statement_count"] == 1
+    assert {results[f"sql.slowest.{rank}.statement"] for rank in (1, 2, 3)} == {
+        "SELECT ?",
+        "SELECT ?, ?",
+        "SELECT ? WHERE ? IN (...)",
+    }
+    slowest = {results[f"sql.slowest.{rank}.statement"]: rank for rank in (1, 2, 3)}
+    assert results[f"sql.slowest.{slowest['SELECT ?']}.count"] == 12
+    assert results[f"sql.slowest.{slowest['SELECT ? WHERE ? IN (...)']}.count"] == 2
+    assert results["sql.n_plus_one.statement"] == "SELECT ?"
+    assert results["sql.n_plus_one.count"] == 12
+
+
+def test_sqlalchemy_monitor_fingerprints_disabled():
+    monitor = SQLAlchemyMonitor()
+    monitor.setup()
+    execute(12)
+    results = monitor.finish()
+    assert monitor.statements == {}
+    assert "sql.n_plus_one.statement" not in results
+
+
+def test_sqlalchemy_pool_monitor():
+    pool_engine = sqlalchemy.create_engine(
+        "sqlite://",
+        poolclass=sqlalchemy.pool.QueuePool,
+        pool_size=1,
+        max_overflow=1,
+        connect_args={"check_same_thread": False},
+    )
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold_connection():
+        with pool_engine.connect():
+            held.set()
+            release.wait()
+
+    monitor = SQLAlchemyPoolMonitor()
+    monitor.engine = pool_engine
+    monitor.setup()
+    with pool_engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 1")).fetchone()
+    with pool_engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 1")).fetchone()
+    holder = threading.Thread(target=hold_connection)
+    holder.start()
+    held.wait()
+    with pool_engine.connect() as conn:
+        # The holder has the pooled connection, so this one opens an overflow connection
+        conn.execute(sqlalchemy.text("SELECT 1")).fetchone()
+        threading.Timer(0.05, release.set).start()
+        # The pool is exhausted until the holder releases its connection
+        with pool_engine.connect() as waiting_conn:
+            waiting_conn.execute(sqlalchemy.text("SELECT 1")).fetchone()
+    holder.join()
+    results = monitor.finish()
+
+    # The holder's checkout happens in another thread, outside the monitor's context
+    assert results["sql.pool.checkout_count"] == 4
+    assert results["sql.pool.connect_count"] == 2
+    assert results["sql.pool.peak_checked_out"] == 2
+    assert results["sql.pool.checkout_wait_musec"] >= 40_000
+
+    # Checkouts after the context has finished are not counted
+    with pool_engine.connect():
+        pass
+    assert monitor.checkout_count == 4
@@ -0,0 +1,165 @@
+import io
+import sys
+from wsgiref.handlers import SimpleHandler
+from wsgiref.util import FileWrapper, setup_testing_defaults
+
+import pytest
+from flask import Flask
+from structlog.testing import capture_logs
+
+import woodchipper
+from woodchipper.context import logging_ctx
+from woodchipper.http.flask import WoodchipperFlask
+from woodchipper.http.wsgi import WoodchipperWSGI
+from woodchipper.processors import inject_context_processor
+
+
+def make_environ(path="/", query_string="", **headers):
+    environ = {"PATH_INFO": path, "QUERY_STRING": query_string}
+    environ.update({f"HTTP_{name.upper()}": value for name, value in headers.items()})
+    setup_testing_defaults(environ)
+    return environ
+
+
+def start_response(status, headers, exc_info=None):
+    return lambda data: None
+
+
+def streaming_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+
+    def body():
+        for i in range(3):
+            woodchipper.get_logger(__name__).info("Streaming chunk.")
+            yield b"x" * 10 * (i + 1)
+
+    return body()
+
+
+def exit_log(caps_logs):
+    return next(log for log in caps_logs if log["event"] == "Exiting context: wsgi:request")
+
+
+def test_wsgi_streaming_response():
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        response = WoodchipperWSGI(streaming_app)(
+            make_environ("/download", "format=csv&col=a&col=b", x_tenant="tenant-1", authorization="secret"),
+            start_response,
+        )
+        # The context stays open while the body is streamed
+        assert not any(log["event"] == "Exiting context: wsgi:request" for log in caps_logs)
+        assert b"".join(response) == b"x" * 60
+        response.close()
+
+    log = exit_log(caps_logs)
+    assert log["http.method"] == "GET"
+    assert log["http.path"] == "http://127.0.0.1/download"
+    assert log["http.query_param.col"] == ["a", "b"]
+    assert log["http.header.x-tenant"] == "tenant-1"
+    assert log["http.header.authorization"] == "******"
+    assert log["http.response.status_code"] == 200
+    assert log["http.response.body_bytes"] == 60
+    assert log["http.response.ttfb_musec"] <= log["context.time_to_run_musec"]
+    assert log["http.response.disconnected"] is False
+    chunk_logs = [log for log in caps_logs if log["event"] == "Streaming chunk."]
+    assert len(chunk_logs) == 3
+    assert all(chunk_log["http.id"] == log["http.id"] for chunk_log in chunk_logs)
+    assert "http.id" not in logging_ctx.as_dict()
+
+
+def test_wsgi_response_length():
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"hello"]
+
+    output = io.BytesIO()
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        SimpleHandler(io.BytesIO(), output, sys.stderr, make_environ()).run(WoodchipperWSGI(app))
+
+    # wsgiref sizes single-item bodies with len()
+    assert b"Content-Length: 5\r\n" in output.getvalue()
+    assert exit_log(caps_logs)["http.response.body_bytes"] == 5
+    # Bodies without a length don't get one
+    sized = WoodchipperWSGI(app)(make_environ(), start_response)
+    sized.close()
+    unsized = WoodchipperWSGI(streaming_app)(make_environ(), start_response)
+    unsized.close()
+    assert len(sized) == 1
+    assert not hasattr(unsized, "__len__")
+
+
+def test_wsgi_client_disconnect():
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        response = WoodchipperWSGI(streaming_app)(make_environ(), start_response)
+        next(response)
+        response.close()
+
+    log = exit_log(caps_logs)
+    assert log["http.response.body_bytes"] == 10
+    assert log["http.response.disconnected"] is True
+
+
+def test_wsgi_app_error():
+    def failing_app(environ, start_response):
+        raise ValueError("oh no!")
+
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        with pytest.raises(ValueError):
+            WoodchipperWSGI(failing_app)(make_environ(), start_response)
+
+    assert exit_log(caps_logs)["http.response.status_code"] == 500
+    assert "http.id" not in logging_ctx.as_dict()
+
+
+def test_wsgi_file_wrapper_response(tmp_path):
+    path = tmp_path / "report.csv"
+    path.write_bytes(b"x" * 100)
+
+    def file_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/csv")])
+        file = open(path, "rb")
+        file.seek(20)
+        return environ["wsgi.file_wrapper"](file, 32)
+
+    environ = make_environ("/report.csv")
+    environ["wsgi.file_wrapper"] = FileWrapper
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        response = WoodchipperWSGI(file_app)(environ, start_response)
+        # The server gets its own file wrapper back, so it can still send the file with sendfile
+        assert isinstance(response, FileWrapper)
+        assert response.filelike.fileno() >= 0
+        assert not any(log["event"] == "Exiting context: wsgi:request" for log in caps_logs)
+        assert b"".join(response) == b"x" * 80
+        response.close()
+
+    log = exit_log(caps_logs)
+    assert log["http.response.status_code"] == 200
+    assert log["http.response.body_bytes"] == 80
+    assert response.filelike.closed
+    assert "http.id" not in logging_ctx.as_dict()
+
+
+def test_wsgi_excluded_paths():
+    with capture_logs() as caps_logs:
+        response = WoodchipperWSGI(streaming_app, excluded_paths=[r"/health"])(make_environ("/health"), start_response)
+        b"".join(response)
+    assert [log["event"] for log in caps_logs] == ["Streaming chunk."] * 3
+
+
+def test_wsgi_wrapping_flask():
+    app = Flask(__name__)
+    WoodchipperFlask(app).chipperize()
+    app.wsgi_app = WoodchipperWSGI(app.wsgi_app)
+
+    @app.route("/")
+    def hello():
+        return logging_ctx.as_dict()
+
+    with capture_logs(processors=[inject_context_processor]) as caps_logs:
+        with app.test_client() as client:
+            response = client.get("/")
+            response.close()
+
+    # The Flask context reuses the ID of the request given by the WSGI middleware
+    assert response.json["http.id"] == exit_log(caps_logs)["http.id"]
+    assert exit_log(caps_logs)["http.response.body_bytes"] == len(response.data)
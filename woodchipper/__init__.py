@@ -1,13 +1,23 @@
 import importlib
 import logging.config
-from typing import Callable, Dict, List, Set, Type, Union
+from typing import TYPE_CHECKING, Callable, Dict, List, Set, Type, Union
 
 import structlog
 
+import woodchipper.handlers
 from woodchipper.monitors import BaseMonitor
+from woodchipper.processors import materialize_context_processor
+
+if TYPE_CHECKING:
+    from woodchipper.context import LoggableValue
+
+ContextSink = Callable[[str, Dict[str, "LoggableValue"]], None]
 
 _monitors: Set[Type[BaseMonitor]] = set()
 _facilities: Dict[str, str] = {}
+_context_sinks: List[ContextSink] = []
+# The standard library logger of each name checked by is_enabled_for
+_loggers: Dict[str, logging.Logger] = {}
 
 
 class BaseConfigClass:
@@ -23,38 +33,64 @@ def configure(
     facilities: Dict[str, str] = {"": "INFO"},
     override_existing: bool = True,
     monitors: List[Type[BaseMonitor]] = [],
+    use_queue: bool = False,
+    queue_size: int = 10_000,
+    queue_overflow: str = "block",
+    context_sinks: List[ContextSink] = [],
 ) -> None:
     _monitors.update(set(monitors))
     _facilities.update(facilities)
+    _context_sinks.extend(sink for sink in context_sinks if sink not in _context_sinks)
     if isinstance(config, str):
         module_name, cls_name = config.rsplit(".", 1)
         module_obj = importlib.import_module(module_name)
         config = getattr(module_obj, cls_name)
         assert isinstance(config, type)
+    # Renderers producing bytes need a formatter and handler that don't convert them to str
+    renders_bytes = getattr(config.renderer, "as_bytes", False)
+    handler_config = {
+        "level": "DEBUG",
+        "formatter": "structlog",
+        "filters": ["tail_sampling"],
+        "stream": "ext://sys.stdout",
+    }
+    if use_queue:
+        handler_config.update(
+            {"()": "woodchipper.handlers.QueueingStreamHandler", "queue_size": queue_size, "overflow": queue_overflow}
+        )
+    else:
+        handler_config["class"] = (
+            "woodchipper.handlers.BytesStreamHandler" if renders_bytes else "logging.StreamHandler"
+        )
     dict_config = {
         "version": 1,
         "disable_existing_loggers": override_existing,
         "formatters": {
             "structlog": {
-                "()": structlog.stdlib.ProcessorFormatter,
+                "()": (
+                    woodchipper.handlers.BytesProcessorFormatter
+                    if renders_bytes
+                    else structlog.stdlib.ProcessorFormatter
+                ),
                 "foreign_pre_chain": config.processors,
-                "processors": [structlog.stdlib.ProcessorFormatter.remove_processors_meta, config.renderer],
-            }
-        },
-        "handlers": {
-            "woodchipper": {
-                "level": "DEBUG",
-                "formatter": "structlog",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
+                "processors": [
+                    structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+                    *([] if getattr(config.renderer, "renders_layers", False) else [materialize_context_processor]),
+                    config.renderer,
+                ],
             }
         },
+        "filters": {"tail_sampling": {"()": woodchipper.handlers.TailSamplingFilter}},
+        "handlers": {"woodchipper": handler_config},
         "loggers": {
             facility: {"handlers": ["woodchipper"], "level": level, "propagate": False}
             for facility, level in facilities.items()
         },
     }
     logging.config.dictConfig(dict_config)
+    woodchipper.handlers.bind_tail_sampling_filters(
+        {handler for facility in facilities for handler in logging.getLogger(facility).handlers}
+    )
 
     structlog.configure(
         processors=config.processors + [structlog.stdlib.ProcessorFormatter.wrap_for_formatter],
@@ -67,6 +103,8 @@ def configure(
 
 def reset():
     structlog.reset_defaults()
+    # Drain and stop any background writer, so nothing logged so far is lost
+    woodchipper.handlers.close_queueing_handlers()
 
 
 def get_monitors():
@@ -77,5 +115,23 @@ def get_facilities():
     return _facilities
 
 
+def get_context_sinks():
+    return list(_context_sinks)
+
+
+def is_enabled_for(name: str, level: int) -> bool:
+    """Whether a message at `level` on logger `name` would be emitted under the configured facilities. Cheap enough
+    to check before building a log message."""
+    if not _facilities:
+        # Woodchipper hasn't been configured, so structlog's defaults apply and emit everything
+        return True
+    try:
+        logger = _loggers[name]
+    except KeyError:
+        logger = _loggers[name] = logging.getLogger(name)
+    # Levels are read from the logger hierarchy on every call, so ones set with setLevel() after configure() apply
+    return level > logging.root.manager.disable and level >= logger.getEffectiveLevel()
+
+
 def get_logger(name: str) -> structlog.BoundLogger:
     return structlog.get_logger(name)
@@ -1,6 +1,11 @@
+import datetime
 import importlib
+import json
 import logging
 import os
+import uuid
+from decimal import Decimal
+from typing import Any, Callable, Optional, Tuple, Union
 
 import structlog
 
@@ -17,6 +22,7 @@ except ImportError:
             return event_dict
 
 
+import woodchipper.context
 import woodchipper.logger
 import woodchipper.processors
 from woodchipper import BaseConfigClass
@@ -37,6 +43,137 @@ else:
     _style_dict = None
 
 
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, (Decimal, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    try:
+        return obj.__structlog__()
+    except AttributeError:
+        return repr(obj)
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, default=_json_default).encode("utf-8")
+
+
+def _load_json_backend(backend: str) -> Callable[[Any], bytes]:
+    """Return a function serializing an event dict to JSON bytes with the named library. Raises ImportError if the
+    library isn't installed."""
+    if backend == "orjson":
+        import orjson
+
+        # Route dates, times and dataclasses through _json_default, so they render as with the standard library
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+        def orjson_dumps(obj: Any) -> bytes:
+            try:
+                return orjson.dumps(obj, default=_json_default, option=options)
+            except TypeError:
+                # orjson refuses some values outright, such as integers wider than 64 bits and non-string keys
+                return _stdlib_dumps(obj)
+
+        return orjson_dumps
+    elif backend == "msgspec":
+        import msgspec
+
+        encoder = msgspec.json.Encoder(enc_hook=_json_default)
+
+        def msgspec_dumps(obj: Any) -> bytes:
+            try:
+                return encoder.encode(obj)
+            except (TypeError, OverflowError):
+                return _stdlib_dumps(obj)
+
+        return msgspec_dumps
+    elif backend == "ujson":
+        import ujson
+
+        def ujson_dumps(obj: Any) -> bytes:
+            try:
+                return ujson.dumps(obj, default=_json_default, ensure_ascii=False).encode("utf-8")
+            except (TypeError, OverflowError):
+                return _stdlib_dumps(obj)
+
+        return ujson_dumps
+    elif backend == "json":
+        return _stdlib_dumps
+    raise ValueError(f"Unknown JSON backend {backend!r}, expected one of {FastJSONRenderer.backends}.")
+
+
+class FastJSONRenderer:
+    """
+    Renders an event dict as JSON using the fastest library installed, trying orjson, msgspec and
+    ujson before falling back to the standard library, which lays messages out as structlog's
+    JSONRenderer does. Pass `backend` to pick one explicitly.
+
+    Values a library can't serialize on its own are converted the same way for every backend: Decimal
+    and UUID values become strings, dates and times become ISO-8601 strings, objects with a
+    `__structlog__` method are rendered with it and anything else is rendered with repr(). Values a
+    library rejects outright, such as integers wider than 64 bits for orjson, fall back to the
+    standard library for that message.
+
+    The faster libraries don't render every message as the standard library does. They write
+    non-ASCII text as UTF-8 rather than escaping it, and leave out the spaces after separators.
+    orjson and msgspec render NaN and infinite floats as null, and Enum members as their value rather
+    than their repr(). msgspec renders UTC datetimes with a `Z` suffix rather than `+00:00`, and ujson
+    renders Decimal values as JSON numbers.
+
+    With `as_bytes`, the rendered message is returned as bytes, which woodchipper.configure writes
+    straight to the stream's binary buffer without decoding it to a str first.
+
+    Events layered over the context by lazy_inject_context_processor are rendered without merging
+    the two: the context is rendered once, and reused by every message logged until it changes.
+    """
+
+    # Tells woodchipper.configure to hand over ContextEventDicts as they are, rather than merged into a dict
+    renders_layers = True
+
+    # Tried in order when no backend is given
+    backends = ("orjson", "msgspec", "ujson", "json")
+
+    def __init__(self, backend: Optional[str] = None, as_bytes: bool = False):
+        if backend is None:
+            for candidate in self.backends:
+                try:
+                    self._dumps = _load_json_backend(candidate)
+                except ImportError:
+                    continue
+                backend = candidate
+                break
+        else:
+            self._dumps = _load_json_backend(backend)
+        self.backend = backend
+        self.as_bytes = as_bytes
+        self._separator = b", " if backend == "json" else b","
+        # The last context rendered, and its members rendered without the enclosing braces
+        self._rendered_context: Tuple[Any, bytes] = (None, b"")
+
+    def _render_layers(self, event_dict: woodchipper.processors.ContextEventDict) -> bytes:
+        event, ctx_items = event_dict.maps[0], event_dict.maps[1]
+        if not ctx_items or any(key in ctx_items for key in event):
+            # Keys of the event that replace keys of the context have to take their place
+            return self._dumps(event_dict.to_dict())
+        rendered_ctx, ctx_members = self._rendered_context
+        if rendered_ctx is not ctx_items:
+            # The context is immutable, so it is rendered once for every message logged while it is current
+            ctx_members = self._dumps(
+                ctx_items.to_dict() if isinstance(ctx_items, woodchipper.context.PersistentContextMap) else ctx_items
+            )[1:-1]
+            self._rendered_context = (ctx_items, ctx_members)
+        if not event:
+            return b"{" + ctx_members + b"}"
+        return b"{" + ctx_members + self._separator + self._dumps(event)[1:]
+
+    def __call__(self, logger: logging.Logger, name: str, event_dict: dict) -> Union[str, bytes]:
+        if isinstance(event_dict, woodchipper.processors.ContextEventDict):
+            rendered = self._render_layers(event_dict)
+        else:
+            rendered = self._dumps(event_dict)
+        return rendered if self.as_bytes else rendered.decode("utf-8")
+
+
 class Minimal(BaseConfigClass):
     """
     Really used for unit tests. That's it.
@@ -64,7 +201,7 @@ class DevLogToStdout(BaseConfigClass):
         structlog.processors.CallsiteParameterAdder(
             parameters=callsite_parameters, additional_ignores=["woodchipper"]
         ),
-        woodchipper.processors.inject_context_processor,
+        woodchipper.processors.lazy_inject_context_processor,
     ]
     factory = structlog.stdlib.LoggerFactory()
     wrapper_class = woodchipper.logger.BoundLogger
@@ -89,8 +226,8 @@ class JSONLogToStdout(BaseConfigClass):
         SentryJsonProcessor(level=logging.ERROR, as_extra=True, active=not os.getenv("WOODCHIPPER_DISABLE_SENTRY")),
         structlog.processors.format_exc_info,
         structlog.processors.UnicodeDecoder(),
-        woodchipper.processors.inject_context_processor,
+        woodchipper.processors.lazy_inject_context_processor,
     ]
     factory = structlog.stdlib.LoggerFactory()
     wrapper_class = woodchipper.logger.BoundLogger
-    renderer = structlog.processors.JSONRenderer()
+    renderer = FastJSONRenderer(as_bytes=True)
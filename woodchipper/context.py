@@ -2,13 +2,20 @@ import contextvars
 import inspect
 import logging
 import os
+import sys
 import time
 from collections.abc import MutableMapping
 from decimal import Decimal
 from functools import wraps
-from typing import Any, Mapping, NamedTuple, Optional, Tuple, Union, cast
+from types import CodeType
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple, Union, cast
 
 import woodchipper
+import woodchipper.handlers
+import woodchipper.monitors
+
+if TYPE_CHECKING:
+    from woodchipper.monitors import BaseMonitor
 
 LoggableValue = Optional[Union[str, int, bool, Decimal, float]]
 LoggingContextType = Mapping[str, LoggableValue]
@@ -56,48 +63,170 @@ def pluck_value(obj, str_path: str, delimiter=".") -> Union[Any, Missing]:
             return pluck_value(value, remaining, delimiter)
 
 
-class ParamSearchConfig(NamedTuple):
-    dig_path: str
-    logvar_name: str
-    diggable: bool
-
+class ParamAccessor(NamedTuple):
+    """Where to find the value for one decorator dig path in a call's arguments, resolved against the decorated
+    function's signature once, at decoration time."""
 
-def _build_path_head_to_param_config_map(kwargs: Mapping, *, delimiter: str = ".") -> Mapping[str, ParamSearchConfig]:
-    return_mapping = {}
+    logvar_name: str
+    param_name: str
+    kind: Optional[Any]  # The inspect.Parameter kind, or None if the function has no such parameter
+    position: Optional[int]  # Index in the positional arguments, if the parameter can be passed positionally
+    path: Tuple[str, ...]  # Segments to dig into the argument value
+    keyword_params: frozenset  # Parameters that can be passed by name, to tell them apart from **kwargs
+
+
+def _compile_param_accessors(f, kwargs: Mapping[str, str], *, delimiter: str = ".") -> Tuple[ParamAccessor, ...]:
+    parameters = list(inspect.signature(f).parameters.values())
+    keyword_params = frozenset(
+        param.name
+        for param in parameters
+        if param.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)
+    )
+    accessors = []
     for logvar_name, dig_path in kwargs.items():
         if dig_path == "":
             raise ValueError("Dig path cannot be an empty string")
 
-        dig_path_head, dig_path_tail = _split_head_node(dig_path, delimiter)
+        param_name, *path = dig_path.split(delimiter)
+        kind, position = None, None
+        for index, param in enumerate(parameters):
+            if param.name == param_name:
+                kind = param.kind
+                if kind in (
+                    inspect.Parameter.POSITIONAL_ONLY,
+                    inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                    inspect.Parameter.VAR_POSITIONAL,
+                ):
+                    position = index
+                break
+        accessors.append(ParamAccessor(logvar_name, param_name, kind, position, tuple(path), keyword_params))
+    return tuple(accessors)
+
+
+def _get_param_value(accessor: ParamAccessor, args: Tuple, kwargs: Mapping[str, Any], missing_default) -> Any:
+    """Fetch the value for a dig path from a call's arguments, the same way `inspect.signature(f).bind` would pair
+    them up, without binding the whole call. Defaults of parameters that weren't passed are not applied."""
+    kind = accessor.kind
+    if kind is None:
+        return missing_default
+    elif kind is inspect.Parameter.VAR_POSITIONAL:
+        if len(args) <= accessor.position:
+            return missing_default
+        value = tuple(args[accessor.position :])
+    elif kind is inspect.Parameter.VAR_KEYWORD:
+        value = {k: v for k, v in kwargs.items() if k not in accessor.keyword_params}
+        if not value:
+            return missing_default
+    elif accessor.position is not None and accessor.position < len(args):
+        value = args[accessor.position]
+    elif kind is not inspect.Parameter.POSITIONAL_ONLY and accessor.param_name in kwargs:
+        value = kwargs[accessor.param_name]
+    else:
+        return missing_default
 
-        return_mapping[dig_path_head] = ParamSearchConfig(
-            dig_path=dig_path_tail,
-            logvar_name=logvar_name,
-            diggable=True if dig_path_tail else False,
-        )
+    for segment in accessor.path:
+        value = _get_key_or_attr(value, segment)
+        if value is missing:
+            return missing
+    return value
+
+
+class _Deleted:
+    """Marks a key removed in a layer of a PersistentContextMap."""
+
+    def __repr__(self):
+        return "<deleted>"
+
+
+_deleted = _Deleted()
+
+
+class PersistentContextMap(Mapping):
+    """An immutable mapping that shares structure with the mapping it was derived from, much like the HAMT backing
+    `contextvars.Context`. Deriving a new map only records the changed keys, so nesting costs O(changed keys) rather
+    than O(total keys). Lookups walk the chain of layers, which is flattened once it grows past `max_depth`."""
+
+    __slots__ = ("_parent", "_changes", "_depth", "_flat")
+
+    max_depth = 8
 
-    return return_mapping
+    def __init__(self, changes: Optional[Mapping[str, Any]] = None, parent: Optional["PersistentContextMap"] = None):
+        self._parent = parent
+        self._changes: Dict[str, Any] = dict(changes) if changes else {}
+        self._depth: int = parent._depth + 1 if parent is not None else 0
+        self._flat: Optional[Dict[str, LoggableValue]] = None
+
+    def set_many(self, changes: Mapping[str, LoggableValue]) -> "PersistentContextMap":
+        if self._depth >= self.max_depth:
+            flattened = self.to_dict()
+            flattened.update(changes)
+            return PersistentContextMap(flattened)
+        return PersistentContextMap(changes, self)
+
+    def delete(self, key: str) -> "PersistentContextMap":
+        if key not in self:
+            raise KeyError(key)
+        return self.set_many({key: _deleted})
+
+    def to_dict(self) -> Dict[str, LoggableValue]:
+        """Return a new dict with the contents of this map."""
+        return dict(self._flattened())
+
+    def _flattened(self) -> Dict[str, LoggableValue]:
+        # The map is immutable, so the flattened contents are computed once and cached. Callers must not mutate it.
+        if self._flat is None:
+            flat = self._parent.to_dict() if self._parent is not None else {}
+            for key, value in self._changes.items():
+                if value is _deleted:
+                    flat.pop(key, None)
+                else:
+                    flat[key] = value
+            self._flat = flat
+        return self._flat
+
+    def __getitem__(self, key: str) -> LoggableValue:
+        node: Optional[PersistentContextMap] = self
+        while node is not None:
+            if node._flat is not None:
+                return node._flat[key]
+            if key in node._changes:
+                value = node._changes[key]
+                if value is _deleted:
+                    raise KeyError(key)
+                return value
+            node = node._parent
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._flattened())
+
+    def __len__(self):
+        return len(self._flattened())
+
+    def __repr__(self):
+        return repr(self._flattened())
 
 
 class LoggingContextVar(MutableMapping):
     _var: contextvars.ContextVar[LoggingContextType]
 
-    def __init__(self, name):
-        self._var = contextvars.ContextVar(name, default={})
+    def __init__(self, name, *, persistent: bool = False):
+        self._var = contextvars.ContextVar(name, default=PersistentContextMap() if persistent else {})
 
     def __getitem__(self, key: str) -> LoggableValue:
         return self._var.get().get(key)
 
     def __setitem__(self, key: str, value: LoggableValue) -> contextvars.Token:
-        updated = dict(self._var.get())
-        updated[key] = value
-        return self._var.set(updated)
+        return self.update({key: value})
 
     def __eq__(self, val) -> bool:
         return val == self._var.get()
 
     def __delitem__(self, key: str) -> contextvars.Token:
-        updated = dict(self._var.get())
+        current = self._var.get()
+        if isinstance(current, PersistentContextMap):
+            return self._var.set(current.delete(key))
+        updated = dict(current)
         del updated[key]
         return self._var.set(updated)
 
@@ -111,17 +240,34 @@ class LoggingContextVar(MutableMapping):
         return repr(self._var.get())
 
     def as_dict(self):
-        return dict(self._var.get())
+        current = self._var.get()
+        if isinstance(current, PersistentContextMap):
+            return current.to_dict()
+        return dict(current)
+
+    def snapshot(self) -> LoggingContextType:
+        """Return the current context mapping without copying it. The mapping is shared and must not be mutated."""
+        return self._var.get()
+
+    def restore(self, snapshot: LoggingContextType) -> contextvars.Token:
+        """Make a mapping returned by snapshot() the current context again. The returned token undoes it."""
+        return self._var.set(snapshot)
 
     def update(self, d: LoggingContextType) -> contextvars.Token:
-        token = None
-        for key, value in d.items():
-            new_token = self.__setitem__(key, value)
-            if token is None:
-                token = new_token
-        if token is None:
+        """Apply every key in `d` with a single copy and a single ContextVar set. The returned token resets the
+        context to its state before the update."""
+        if not d:
             raise ValueError("Cannot update with empty mapping.")
-        return token
+        current = self._var.get()
+        if isinstance(current, PersistentContextMap):
+            return self._var.set(current.set_many(d))
+        updated = dict(current)
+        updated.update(d)
+        return self._var.set(updated)
+
+    def checkpoint(self) -> contextvars.Token:
+        """Return a token that resets the context to its current state, undoing any updates made after this call."""
+        return self._var.set(self._var.get())
 
     def reset(self, token: contextvars.Token):
         self._var.reset(token)
@@ -154,6 +300,86 @@ def _convert_to_valid_log_level(log_level: Union[str, int, Missing]) -> int:
     return log_level
 
 
+CPU_CLOCKS: Dict[str, Callable[[], int]] = {"thread": time.thread_time_ns, "process": time.process_time_ns}
+
+
+def _convert_to_cpu_clock(cpu_time: Union[str, None, Missing]) -> Optional[Callable[[], int]]:
+    if isinstance(cpu_time, Missing):
+        cpu_time = os.getenv("WOODCHIPPER_CONTEXT_CPU_TIME")
+    if not cpu_time:
+        return None
+    return CPU_CLOCKS.get(cpu_time.lower())
+
+
+def _convert_to_slow_threshold(threshold: Union[int, None, Missing]) -> Optional[int]:
+    if isinstance(threshold, Missing):
+        env_threshold = os.getenv("WOODCHIPPER_TAIL_SLOW_MUSEC")
+        try:
+            return int(env_threshold) if env_threshold else None
+        except ValueError:
+            return None
+    return threshold
+
+
+# Maps a code object to the (module name, default context name) of the function it belongs to. Bounded so that
+# dynamically generated code (exec, lambdas in loops) cannot grow it without limit.
+_caller_cache: Dict[CodeType, Tuple[str, str]] = {}
+_CALLER_CACHE_MAX_SIZE = 4096
+
+
+def _resolve_caller(depth: int = 1) -> Tuple[str, str]:
+    """Return the module name and default context name (`module:function`) of the frame `depth` levels above the
+    caller of this function. Only that single frame is read, and results are cached per code object."""
+    frame = sys._getframe(depth + 1)
+    code = frame.f_code
+    try:
+        return _caller_cache[code]
+    except KeyError:
+        pass
+    module_name = frame.f_globals.get("__name__")
+    if not isinstance(module_name, str):
+        module = inspect.getmodule(frame)
+        module_name = module.__name__ if module else "<unknown>"
+    resolved = (module_name, f"{module_name}:{code.co_name}")
+    if len(_caller_cache) >= _CALLER_CACHE_MAX_SIZE:
+        _caller_cache.clear()
+    _caller_cache[code] = resolved
+    return resolved
+
+
+_no_monitors: List["BaseMonitor"] = []
+
+
+class _ContextFrame:
+    """The state of a single entry into a LoggingContext, kept apart from the LoggingContext itself so that one
+    decorated function can run concurrently across threads and tasks."""
+
+    __slots__ = (
+        "context",
+        "token",
+        "start_time_ns",
+        "cpu_start_time_ns",
+        "monitors",
+        "module_name",
+        "log_enabled",
+        "measured",
+        "tail_buffer",
+        "tail_token",
+    )
+
+    def __init__(self, context: LoggingContextType, module_name: str):
+        self.context = context
+        self.token: Optional[contextvars.Token] = None
+        self.start_time_ns = 0
+        self.cpu_start_time_ns = 0
+        self.monitors: List["BaseMonitor"] = _no_monitors
+        self.module_name = module_name
+        self.log_enabled = False
+        self.measured = False
+        self.tail_buffer: Optional[woodchipper.handlers.TailBuffer] = None
+        self.tail_token: Optional[contextvars.Token] = None
+
+
 class LoggingContext:
     """A context manager for logging context. Can also be used as a decorator.
 
@@ -164,8 +390,6 @@ class LoggingContext:
     ```
     """
 
-    start_time: float
-
     def __init__(
         self,
         name=None,
@@ -174,6 +398,9 @@ class LoggingContext:
         _missing_default=missing,
         _path_delimiter=".",
         _log_level: Union[str, int, Missing] = missing,
+        _cpu_time: Union[str, None, Missing] = missing,
+        _tail_sampling: Union[bool, Missing] = missing,
+        _tail_slow_musec: Union[int, None, Missing] = missing,
         **kwargs: LoggableValue,
     ):
         self.name = name
@@ -182,96 +409,220 @@ class LoggingContext:
         self._log_level = _convert_to_valid_log_level(
             os.getenv("WOODCHIPPER_CONTEXT_LOG_LEVEL", DEFAULT_LOG_LEVEL) if _log_level is missing else _log_level
         )
-        self._token = None
-        self._monitors = [cls() for cls in woodchipper._monitors]
+        self._cpu_clock = _convert_to_cpu_clock(_cpu_time)
+        self._tail_sampling = (
+            bool(os.getenv("WOODCHIPPER_TAIL_SAMPLING")) if _tail_sampling is missing else _tail_sampling
+        )
+        self._tail_slow_musec = _convert_to_slow_threshold(_tail_slow_musec)
+        # Frames of the entries made through the context manager protocol, innermost last
+        self._frames: List[_ContextFrame] = []
         self.missing_default = _missing_default
         self.path_delimiter = _path_delimiter
 
-    def __enter__(self):
-        self._token = logging_ctx.update(
-            {(f"{self.prefix}.{k}" if self.prefix else k): v for k, v in self.injected_context.items()}
+    def _enter(self, injected_context: Mapping[str, LoggableValue], module_name: str) -> _ContextFrame:
+        frame = _ContextFrame(
+            {(f"{self.prefix}.{k}" if self.prefix else k): v for k, v in injected_context.items()}, module_name
         )
+        if self._tail_sampling:
+            frame.tail_buffer = woodchipper.handlers.TailBuffer(woodchipper.handlers.tail_buffer.get())
+        self._resume(frame)
+
+        # Skip building the entrance and exit messages entirely if they would be filtered out, and only measure the
+        # context if those messages or a context sink will make use of the measurements.
+        frame.log_enabled = woodchipper.is_enabled_for(module_name, self._log_level)
+        frame.measured = frame.log_enabled or bool(woodchipper._context_sinks)
+        if frame.measured:
+            if woodchipper._monitors:
+                frame.monitors = woodchipper.monitors.acquire_monitors(woodchipper._monitors)
+            for monitor in frame.monitors:
+                monitor.setup()
+            if self._cpu_clock is not None:
+                frame.cpu_start_time_ns = self._cpu_clock()
+        if frame.measured or frame.tail_buffer is not None:
+            frame.start_time_ns = time.perf_counter_ns()
+        if frame.log_enabled:
+            woodchipper.get_logger(module_name).log(
+                self._log_level, f"Entering context: {self.name}", context_name=self.name
+            )
+        return frame
+
+    def _exit(self, frame: _ContextFrame, failed: bool = False):
+        if not frame.measured and frame.tail_buffer is None:
+            self._suspend(frame)
+            return
+        time_to_run_musec = (time.perf_counter_ns() - frame.start_time_ns) // 1000
+        monitored_data: Dict[str, LoggableValue] = {}
+        if frame.measured:
+            monitored_data["context.time_to_run_musec"] = time_to_run_musec
+            if self._cpu_clock is not None:
+                monitored_data["context.cpu_time_musec"] = (self._cpu_clock() - frame.cpu_start_time_ns) // 1000
+            if frame.monitors:
+                for monitor in frame.monitors:
+                    monitor.finish_into(monitored_data)
+                woodchipper.monitors.release_monitors(frame.monitors)
+                frame.monitors = _no_monitors
+        if frame.tail_buffer is not None:
+            self._close_tail_buffer(frame, failed, time_to_run_musec, monitored_data)
+        if frame.measured:
+            for sink in woodchipper._context_sinks:
+                sink(self.name, monitored_data)
+            if frame.log_enabled:
+                woodchipper.get_logger(frame.module_name).log(
+                    self._log_level, f"Exiting context: {self.name}", context_name=self.name, **monitored_data
+                )
+        self._suspend(frame)
+
+    def _close_tail_buffer(
+        self, frame: _ContextFrame, failed: bool, time_to_run_musec: int, monitored_data: Dict[str, LoggableValue]
+    ):
+        """Release the records held for the outermost context if it, or a nested context, failed, answered with a
+        server error or ran slow, and discard them otherwise. A nested context hands its records over to the enclosing
+        one instead. The exit message is logged afterwards, so it is never held back by the context's own buffer."""
+        buffer, frame.tail_buffer = frame.tail_buffer, None
+        if frame.tail_token is not None:
+            woodchipper.handlers.tail_buffer.reset(frame.tail_token)
+            frame.tail_token = None
+        status_code = logging_ctx["http.response.status_code"]
+        keep = (
+            failed
+            or buffer.keep
+            or (isinstance(status_code, int) and status_code >= 500)
+            or (self._tail_slow_musec is not None and time_to_run_musec > self._tail_slow_musec)
+        )
+        monitored_data["context.tail_buffered_count"] = len(buffer.records)
+        if buffer.overflow_count:
+            monitored_data["context.tail_overflow_count"] = buffer.overflow_count
+        if buffer.parent is not None:
+            # Only the outermost context decides, so a healthy nested context's records are still there if the
+            # enclosing one goes on to fail
+            monitored_data["context.tail_sampling"] = "deferred"
+            buffer.hand_over(keep)
+        else:
+            monitored_data["context.tail_sampling"] = "kept" if keep else "discarded"
+            if keep:
+                buffer.release()
+
+    def _resume(self, frame: _ContextFrame):
+        # Even without context variables of its own, the context undoes updates made within it when it exits
+        frame.token = logging_ctx.update(frame.context) if frame.context else logging_ctx.checkpoint()
+        if frame.tail_buffer is not None:
+            frame.tail_token = woodchipper.handlers.tail_buffer.set(frame.tail_buffer)
+        for monitor in frame.monitors:
+            monitor.resume()
+
+    def _suspend(self, frame: _ContextFrame):
+        for monitor in reversed(frame.monitors):
+            monitor.suspend()
+        if frame.tail_token is not None:
+            woodchipper.handlers.tail_buffer.reset(frame.tail_token)
+            frame.tail_token = None
+        if frame.token is not None:
+            logging_ctx.reset(frame.token)
+            frame.token = None
 
-        current_frame = inspect.currentframe()
-        calling_frame = inspect.getouterframes(current_frame, 2)[1]
-        module = inspect.getmodule(calling_frame[0])
-        module_name = module.__name__ if module else "<unknown>"
+    def __enter__(self):
+        module_name, default_name = _resolve_caller(1)
         if self.name is None:
-            func_name = calling_frame[3]
-            self.name = f"{module_name}:{func_name}"
-
-        for monitor in self._monitors:
-            monitor.setup()
-        self.start_time = time.time()
-        woodchipper.get_logger(module_name).log(
-            self._log_level, f"Entering context: {self.name}", context_name=self.name
-        )
+            self.name = default_name
+        self._frames.append(self._enter(self.injected_context, module_name))
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        current_frame = inspect.currentframe()
-        calling_frame = inspect.getouterframes(current_frame, 2)[1]
-        module = inspect.getmodule(calling_frame[0])
-        module_name = module.__name__ if module else "<unknown>"
-        # If self.name is None, derive the name from the module and function from which we were called
+        self._exit(self._frames.pop(), failed=exc_type is not None)
+        return False
+
+    async def __aenter__(self):
+        module_name, default_name = _resolve_caller(1)
         if self.name is None:
-            func_name = calling_frame[3]
-            self.name = f"{module_name}:{func_name}"
-
-        monitored_data: LoggingContextType = {}
-        monitored_data.update({"context.time_to_run_musec": int((time.time() - self.start_time) * 1e6)})
-        for monitor in self._monitors:
-            monitored_data.update(monitor.finish())
-        woodchipper.get_logger(module_name).log(
-            self._log_level, f"Exiting context: {self.name}", context_name=self.name, **monitored_data
-        )
-        assert self._token
-        logging_ctx.reset(self._token)
-        self._token = None
+            self.name = default_name
+        self._frames.append(self._enter(self.injected_context, module_name))
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._exit(self._frames.pop(), failed=exc_type is not None)
         return False
 
     def __call__(self, f):
-        self.decorator_mapping = _build_path_head_to_param_config_map(
-            self.injected_context, delimiter=self.path_delimiter
-        )
+        # The signature is inspected once, here, turning each dig path into an accessor that knows where in the
+        # call's arguments to look. Note: we will not dig into *args of the function, only take them as a tuple.
+        # TODO: consider a configurable 'log_defaults' decorator parameter that will allow the logging of
+        #  function definition defaults when those arguments aren't passed to the function
+        param_accessors = _compile_param_accessors(f, self.injected_context, delimiter=self.path_delimiter)
         if self.name is None:
             module_name = f.__module__ or "<unknown>"
             self.name = f"{module_name}:{f.__name__}"
 
+        def extract_context(func_args, func_kwargs) -> Dict[str, LoggableValue]:
+            return {
+                accessor.logvar_name: _convert_to_loggable_value(
+                    _get_param_value(accessor, func_args, func_kwargs, self.missing_default)
+                )
+                for accessor in param_accessors
+            }
+
+        # Decorated functions log on this module's logger, the module in which the wrappers enter the context
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_wrapper(*func_args, **func_kwargs):
+                frame = self._enter(extract_context(func_args, func_kwargs), __name__)
+                try:
+                    result = await f(*func_args, **func_kwargs)
+                except BaseException:
+                    self._exit(frame, failed=True)
+                    raise
+                self._exit(frame)
+                return result
+
+            return async_wrapper
+
+        if inspect.isasyncgenfunction(f):
+
+            @wraps(f)
+            async def async_gen_wrapper(*func_args, **func_kwargs):
+                agen = f(*func_args, **func_kwargs)
+                frame = self._enter(extract_context(func_args, func_kwargs), __name__)
+                failed = False
+                # The context is only in effect while the generator runs, so it doesn't leak into the consumer
+                # in between items. Timing and monitors cover the generator's whole lifetime.
+                try:
+                    value = await agen.__anext__()
+                    while True:
+                        self._suspend(frame)
+                        try:
+                            sent = yield value
+                        except GeneratorExit:
+                            self._resume(frame)
+                            await agen.aclose()
+                            raise
+                        except BaseException as exc:
+                            self._resume(frame)
+                            value = await agen.athrow(exc)
+                        else:
+                            self._resume(frame)
+                            value = await agen.asend(sent)
+                except StopAsyncIteration:
+                    return
+                except GeneratorExit:
+                    raise
+                except BaseException:
+                    failed = True
+                    raise
+                finally:
+                    self._exit(frame, failed)
+
+            return async_gen_wrapper
+
         @wraps(f)
         def wrapper(*func_args, **func_kwargs):
-            # This will pair up the function signature parameters with the arguments that were passed. It's ...amazing.
-            # If we wanted to apply defaults as well (that weren't passed but were defined as defaults in the
-            # signature, there's a fairly easy process for that too through this api as well).
-
-            # Note: We not will dig into the *args or **kwargs of the function, if the function definition used
-            # *args or **kwargs. It's more difficult for **kwargs and not possible with *args.
-            # TODO: attempt digging into function **kwargs as well?
-            # TODO: consider a configurable 'log_defaults' decorator parameter that will allow the logging of
-            #  function definition defaults when those arguments aren't passed to the function
-            mapped_args = inspect.signature(f).bind(*func_args, **func_kwargs).arguments
-
-            self.injected_context = {}
-
-            # TODO: extract this functionality so that it's unit testable
-            for dec_param_name, param_config_entry in self.decorator_mapping.items():
-                if dec_param_name not in mapped_args:
-                    raw_value = self.missing_default
-                else:
-                    if param_config_entry.diggable:
-                        raw_value = pluck_value(
-                            mapped_args[dec_param_name],
-                            param_config_entry.dig_path,
-                            delimiter=self.path_delimiter,
-                        )
-                    else:
-                        raw_value = mapped_args[dec_param_name]
-
-                self.injected_context[param_config_entry.logvar_name] = _convert_to_loggable_value(raw_value)
-
-            with self:
-                return f(*func_args, **func_kwargs)
+            frame = self._enter(extract_context(func_args, func_kwargs), __name__)
+            try:
+                result = f(*func_args, **func_kwargs)
+            except BaseException:
+                self._exit(frame, failed=True)
+                raise
+            self._exit(frame)
+            return result
 
         return wrapper
 
 
-logging_ctx = LoggingContextVar("logging_ctx")
+logging_ctx = LoggingContextVar("logging_ctx", persistent=bool(os.getenv("WOODCHIPPER_PERSISTENT_CONTEXT")))
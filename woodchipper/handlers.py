@@ -0,0 +1,269 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import queue
+import threading
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Iterable, NamedTuple, Optional, TextIO
+
+import structlog
+
+if TYPE_CHECKING:
+    from woodchipper.context import LoggingContextType
+
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+_queueing_handlers: "weakref.WeakSet[QueueingStreamHandler]" = weakref.WeakSet()
+
+
+class _RenderedBytes(str):
+    """An empty str carrying a message rendered as bytes through ProcessorFormatter, which expects a str."""
+
+    data: bytes
+
+
+class _BytesPassthroughFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord):
+        if isinstance(record.msg, _RenderedBytes):
+            return record.msg.data
+        return super().format(record)
+
+
+class BytesProcessorFormatter(structlog.stdlib.ProcessorFormatter, _BytesPassthroughFormatter):
+    """
+    A ProcessorFormatter that passes through bytes returned by its renderer, rather than turning them
+    into a str.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        *processors, renderer = self.processors
+
+        def render(logger, name, event_dict):
+            rendered = renderer(logger, name, event_dict)
+            if isinstance(rendered, bytes):
+                wrapped = _RenderedBytes()
+                wrapped.data = rendered
+                return wrapped
+            return rendered
+
+        self.processors = (*processors, render)
+
+
+class BytesStreamHandler(logging.StreamHandler):
+    """
+    A StreamHandler that writes messages formatted as bytes straight to the binary buffer of its
+    stream. Streams without a binary buffer get the decoded message instead.
+    """
+
+    terminator_bytes = b"\n"
+
+    def format(self, record: logging.LogRecord):
+        if self.formatter is None and isinstance(record.msg, bytes):
+            # Already formatted, as records handed over by a QueueingStreamHandler are
+            return record.msg
+        return super().format(record)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            msg = self.format(record)
+            stream = self.stream
+            if isinstance(msg, bytes):
+                buffer = getattr(stream, "buffer", None)
+                if buffer is not None:
+                    # Anything written through the text layer has to go out first to keep messages in order
+                    stream.flush()
+                    buffer.write(msg + self.terminator_bytes)
+                else:
+                    stream.write(msg.decode("utf-8") + self.terminator)
+            else:
+                stream.write(msg + self.terminator)
+            self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The stock listener uses put_nowait, which fails when a bounded queue is full at shutdown
+        self.queue.put(self._sentinel)
+
+
+class QueueingStreamHandler(logging.handlers.QueueHandler):
+    """
+    A handler that formats records on the calling thread and hands them to a background thread that
+    writes them to a stream, so logging calls never wait on the stream or its lock.
+
+    The queue holds at most `queue_size` records. When it is full, `overflow` decides what happens:
+    "block" waits for room, "drop_newest" discards the record being logged and "drop_oldest" discards
+    the oldest queued record to make room. Dropped records are counted in `dropped_count`.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, queue_size: int = 10_000, overflow: str = "block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}.")
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.overflow = overflow
+        self.dropped_count = 0
+        self._drop_lock = threading.Lock()
+        self._stream_handler = BytesStreamHandler(stream)
+        self._listener: Optional[_QueueListener] = _QueueListener(self.queue, self._stream_handler)
+        self._listener.start()
+        _queueing_handlers.add(self)
+
+    def _count_drop(self):
+        with self._drop_lock:
+            self.dropped_count += 1
+
+    def enqueue(self, record: logging.LogRecord):
+        if self._listener is None:
+            # Closed, so there is nothing left to drain the queue. Write synchronously instead.
+            self._stream_handler.handle(record)
+        elif self.overflow == "block":
+            self.queue.put(record)
+        elif self.overflow == "drop_newest":
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._count_drop()
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    pass
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self.queue.task_done()
+                self._count_drop()
+
+    def flush(self):
+        """Wait until every queued record has been written."""
+        if self._listener is not None:
+            self.queue.join()
+        self._stream_handler.flush()
+
+    def close(self):
+        """Write out everything still queued and stop the background thread."""
+        self.acquire()
+        try:
+            listener, self._listener = self._listener, None
+        finally:
+            self.release()
+        if listener is not None:
+            listener.stop()
+        self._stream_handler.flush()
+        super().close()
+
+
+class HeldRecord(NamedTuple):
+    """A record held back by tail sampling, with the handler to emit it through and the context it was logged in."""
+
+    handler: logging.Handler
+    record: logging.LogRecord
+    context: "LoggingContextType"
+
+
+class TailBuffer:
+    """
+    Holds the records logged in a LoggingContext with tail sampling, until the outermost such context
+    exits and either discards them or releases them. Nested contexts hand their records over to the
+    enclosing buffer instead of deciding for themselves. At most `max_records` are held; older records
+    are dropped to make room, and counted in `overflow_count`.
+    """
+
+    __slots__ = ("records", "parent", "keep", "overflow_count")
+
+    max_records = 1000
+
+    def __init__(self, parent: Optional["TailBuffer"] = None):
+        self.records: Deque[HeldRecord] = deque(maxlen=self.max_records)
+        self.parent = parent
+        # Set when a nested context that should be kept handed its records over, so they are not discarded
+        self.keep = False
+        self.overflow_count = 0
+
+    def add(self, held: HeldRecord):
+        if len(self.records) == self.max_records:
+            self.overflow_count += 1
+        self.records.append(held)
+
+    def hand_over(self, keep: bool):
+        """Move the held records to the enclosing buffer, which will keep them along with its own if `keep`."""
+        records, self.records = self.records, deque(maxlen=self.max_records)
+        if keep:
+            self.parent.keep = True
+        for held in records:
+            self.parent.add(held)
+
+    def release(self):
+        """Emit the held records through the handlers that held them back, each in the context it was logged in, so
+        records from the standard library, whose context is only added when they are formatted, get the right one."""
+        from woodchipper.context import logging_ctx
+
+        records, self.records = self.records, deque(maxlen=self.max_records)
+        for handler, record, context in records:
+            token = logging_ctx.restore(context)
+            try:
+                # The record already went through the handler's filters, and the loggers it was logged on
+                handler.acquire()
+                try:
+                    handler.emit(record)
+                finally:
+                    handler.release()
+            finally:
+                logging_ctx.reset(token)
+
+
+tail_buffer: "contextvars.ContextVar[Optional[TailBuffer]]" = contextvars.ContextVar(
+    "woodchipper_tail_buffer", default=None
+)
+
+
+class TailSamplingFilter(logging.Filter):
+    """
+    Diverts records logged while a TailBuffer is active in the current context into that buffer, to be
+    emitted through `handler`, the handler the filter is attached to, if they are kept. Records pass
+    through a filter without a handler.
+    """
+
+    def __init__(self, handler: Optional[logging.Handler] = None):
+        super().__init__()
+        self.handler = handler
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        buffer = tail_buffer.get()
+        if buffer is None or self.handler is None:
+            return True
+        from woodchipper.context import logging_ctx
+
+        buffer.add(HeldRecord(self.handler, record, logging_ctx.snapshot()))
+        return False
+
+
+def bind_tail_sampling_filters(handlers: Iterable[logging.Handler]):
+    """Attach the TailSamplingFilters of `handlers` to the handler they filter, as logging.config can't."""
+    for handler in handlers:
+        for log_filter in handler.filters:
+            if isinstance(log_filter, TailSamplingFilter):
+                log_filter.handler = handler
+
+
+def dropped_record_count() -> int:
+    """The number of records dropped by all queueing handlers because their queue was full."""
+    return sum(handler.dropped_count for handler in list(_queueing_handlers))
+
+
+def close_queueing_handlers():
+    for handler in list(_queueing_handlers):
+        handler.close()
+
+
+atexit.register(close_queueing_handlers)
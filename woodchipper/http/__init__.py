@@ -0,0 +1,105 @@
+import re
+from typing import Any, Collection, Dict, Mapping, Optional, Pattern, Tuple, Union
+from urllib.parse import parse_qsl
+
+MASK = "******"
+# Bounds the names cached by ContextKeys, since clients choose the header and query parameter names they send
+MAX_CACHED_NAMES = 1024
+
+
+class ContextKeys:
+    """
+    Resolves header or query parameter names to the context keys they are logged under, once per
+    name. Names are lowercased and prefixed with `prefix`. Names in `ignored` are not logged, nor are
+    names missing from `allowed` if it is given. Values of names in `masked` are logged as a mask.
+    Names may be given as str or, as ASGI servers pass them, bytes.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        *,
+        masked: Collection[str] = (),
+        allowed: Optional[Collection[str]] = None,
+        ignored: Collection[str] = (),
+    ):
+        self.prefix = prefix
+        self.masked = frozenset(name.lower() for name in masked)
+        self.allowed = frozenset(name.lower() for name in allowed) if allowed is not None else None
+        self.ignored = frozenset(name.lower() for name in ignored)
+        self._cache: Dict[Union[str, bytes], Optional[Tuple[str, bool]]] = {}
+
+    def lookup(self, name: Union[str, bytes]) -> Optional[Tuple[str, bool]]:
+        """Return the context key for `name` and whether its value is masked, or None if it isn't logged."""
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        lowered = (name.decode("latin-1") if isinstance(name, bytes) else name).lower()
+        if lowered in self.ignored or (self.allowed is not None and lowered not in self.allowed):
+            entry = None
+        else:
+            entry = (f"{self.prefix}{lowered}", lowered in self.masked)
+        if len(self._cache) < MAX_CACHED_NAMES:
+            self._cache[name] = entry
+        return entry
+
+
+def compile_excluded_paths(patterns: Collection[str]) -> Optional[Pattern[str]]:
+    """Compile the path patterns of requests left out of logging, or return None if there are none."""
+    # The patterns are combined into one, so excluding a request takes a single match however many there are
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+
+# The headers a WSGI environ holds without the HTTP_ prefix, which are only headers when they have a value
+_CONTENT_KEYS = ("CONTENT_TYPE", "CONTENT_LENGTH")
+
+
+class EnvironHeaderKeys:
+    """
+    Resolves the keys of a WSGI environ to the context keys of the headers they hold, once per key,
+    the way werkzeug resolves them to header names. Keys that hold no header, or a header that
+    `header_keys` doesn't log, resolve to None.
+    """
+
+    def __init__(self, header_keys: ContextKeys):
+        self.header_keys = header_keys
+        self._cache: Dict[str, Optional[Tuple[str, bool]]] = {}
+
+    def lookup(self, environ_key: str) -> Optional[Tuple[str, bool]]:
+        try:
+            return self._cache[environ_key]
+        except KeyError:
+            pass
+        if environ_key.startswith("HTTP_") and environ_key[5:] not in _CONTENT_KEYS:
+            entry = self.header_keys.lookup(environ_key[5:].replace("_", "-"))
+        elif environ_key in _CONTENT_KEYS:
+            entry = self.header_keys.lookup(environ_key.replace("_", "-"))
+        else:
+            entry = None
+        if len(self._cache) < MAX_CACHED_NAMES:
+            self._cache[environ_key] = entry
+        return entry
+
+    def add_headers(self, environ: Mapping[str, Any], context: Dict[str, Any]):
+        """Add the logged headers held in `environ` to `context`."""
+        for environ_key, value in environ.items():
+            entry = self.lookup(environ_key)
+            if entry is None or (not value and environ_key in _CONTENT_KEYS):
+                continue
+            context[entry[0]] = MASK if entry[1] else value
+
+
+def add_query_params(query_string: str, query_param_keys: ContextKeys, context: Dict[str, Any]):
+    """Add the logged parameters of `query_string` to `context`, with the values of repeated parameters in a list."""
+    for name, value in parse_qsl(query_string, keep_blank_values=True):
+        entry = query_param_keys.lookup(name)
+        if entry is None:
+            continue
+        key = entry[0]
+        if key not in context:
+            context[key] = value
+        elif isinstance(context[key], list):
+            context[key].append(value)
+        else:
+            context[key] = [context[key], value]
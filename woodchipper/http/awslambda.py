@@ -1,24 +1,85 @@
 import os
+from typing import Optional
 
-from woodchipper.context import LoggingContext
+from woodchipper.context import LoggingContext, logging_ctx
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None  # type: ignore[assignment]
+
+# Set until the first invocation handled by this process, and then the time the process took to get to it
+_cold_start = True
+_init_duration_musec: Optional[int] = None
+
+
+def _process_age_musec() -> Optional[int]:
+    """The time since the process started in microseconds, or None where /proc is not available. It is only as precise
+    as the clock ticks /proc counts in, usually 10 ms."""
+    try:
+        with open("/proc/self/stat", "rb") as stat:
+            # The command name may hold spaces, so fields are counted from after its closing parenthesis
+            started_ticks = int(stat.read().rsplit(b")", 1)[1].split()[19])
+        with open("/proc/uptime", "rb") as uptime:
+            uptime_sec = float(uptime.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return int((uptime_sec - started_ticks / os.sysconf("SC_CLK_TCK")) * 1_000_000)
+
+
+def _memory_limit_mb(context) -> Optional[int]:
+    # The Lambda runtime gives the limit as a string
+    try:
+        return int(context.memory_limit_in_mb)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _memory_headroom_mb(memory_limit_mb: Optional[int]) -> Optional[int]:
+    """The memory left under the function's limit at the peak resident set size of the process so far."""
+    if memory_limit_mb is None or resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux, where Lambda runs
+    return memory_limit_mb - resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
 
 
 class WoodchipperLambda:
     def __init__(self, app):
         self._app = app
+        # This is a decent sentinel for being in a Lambda environment, and it holds for the life of the process
+        self._in_lambda = "LAMBDA_TASK_ROOT" in os.environ
 
     def __call__(self, environ, start_response):
-        if "LAMBDA_TASK_ROOT" not in os.environ:
-            # This is a decent sentinel for being in a Lambda environment
+        global _cold_start, _init_duration_musec
+        if not self._in_lambda:
             return self._app(environ, start_response)
+        cold_start = _cold_start
+        if cold_start:
+            _cold_start = False
+            _init_duration_musec = _process_age_musec()
         context = environ.get("lambda.context", object())
+        memory_limit_mb = _memory_limit_mb(context)
         with LoggingContext(
             "awslambda:dispatch",
             **{
                 "aws-request-id": getattr(context, "aws_request_id", None),
                 "function-version": getattr(context, "function_version", None),
                 "function-name": getattr(context, "function_name", None),
+                "cold-start": cold_start,
+                "init-duration-musec": _init_duration_musec,
+                "memory-limit-mb": memory_limit_mb,
             },
             _prefix="lambda",
         ):
-            return self._app(environ, start_response)
+            try:
+                return self._app(environ, start_response)
+            finally:
+                get_remaining_time_in_millis = getattr(context, "get_remaining_time_in_millis", None)
+                logging_ctx.update(
+                    {
+                        "lambda.remaining-time-msec": (
+                            get_remaining_time_in_millis() if get_remaining_time_in_millis is not None else None
+                        ),
+                        "lambda.memory-headroom-mb": _memory_headroom_mb(memory_limit_mb),
+                    }
+                )
@@ -1,12 +1,121 @@
+import asyncio
+import time
 import uuid
+from typing import Any, Collection, Dict, Optional
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from starlette.types import ASGIApp, Receive, Scope, Send
 
+import woodchipper
 from woodchipper.context import LoggingContext, logging_ctx
+from woodchipper.http import MASK, ContextKeys, add_query_params
+
+logger = woodchipper.get_logger(__name__)
 
 BLACKLISTED_HEADERS = ["authorization", "cookie"]
 
+_DEFAULT_PORTS = {"http": 80, "https": 443, "ws": 80, "wss": 443}
+
+
+def _request_path(scope: Scope, host: Optional[bytes]) -> str:
+    """The URL of the request without its query string, built from the scope the same way Starlette builds
+    `request.url`."""
+    scheme = scope.get("scheme", "http")
+    path = scope.get("root_path", "") + scope["path"]
+    if host is not None:
+        return f"{scheme}://{host.decode('latin-1')}{path}"
+    server = scope.get("server")
+    if server is None:
+        return path
+    server_host, port = server
+    if port == _DEFAULT_PORTS.get(scheme):
+        return f"{scheme}://{server_host}{path}"
+    return f"{scheme}://{server_host}:{port}{path}"
+
+
+def _content_length(headers) -> int:
+    for name, value in headers:
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return 0
+    return 0
+
+
+class _ResponseStats:
+    """Counters for a response, updated as it is sent and written to the context once, when it is complete."""
+
+    __slots__ = (
+        "started_at_ns",
+        "status_code",
+        "content_length",
+        "ttfb_ns",
+        "body_bytes",
+        "completed",
+        "disconnected",
+        "cancelled",
+    )
+
+    def __init__(self):
+        self.started_at_ns = time.perf_counter_ns()
+        self.status_code: Optional[int] = None
+        self.content_length = 0
+        self.ttfb_ns: Optional[int] = None
+        self.body_bytes = 0
+        self.completed = False
+        self.disconnected = False
+        self.cancelled = False
+
+    def as_context(self) -> Dict[str, Any]:
+        return {
+            "http.response.status_code": self.status_code,
+            "http.response.content_length": self.content_length,
+            "http.response.ttfb_musec": self.ttfb_ns // 1000 if self.ttfb_ns is not None else None,
+            "http.response.body_bytes": self.body_bytes,
+            "http.response.disconnected": self.disconnected,
+            "http.response.cancelled": self.cancelled,
+        }
+
+
+def _message_size(message) -> int:
+    text = message.get("text")
+    if text is not None:
+        return len(text.encode("utf-8"))
+    data = message.get("bytes")
+    return len(data) if data is not None else 0
+
+
+class _WebSocketStats:
+    """Counters for a WebSocket session, updated as messages pass and written to the context once, when it ends."""
+
+    __slots__ = (
+        "accepted",
+        "messages_received",
+        "messages_sent",
+        "bytes_received",
+        "bytes_sent",
+        "close_code",
+    )
+
+    def __init__(self):
+        self.accepted = False
+        self.messages_received = 0
+        self.messages_sent = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.close_code: Optional[int] = None
+
+    def as_context(self) -> Dict[str, Any]:
+        return {
+            "websocket.accepted": self.accepted,
+            "websocket.messages_received": self.messages_received,
+            "websocket.messages_sent": self.messages_sent,
+            "websocket.bytes_received": self.bytes_received,
+            "websocket.bytes_sent": self.bytes_sent,
+            "websocket.close_code": self.close_code,
+        }
+
 
 class WoodchipperFastAPI:
     def __init__(
@@ -14,63 +123,218 @@ class WoodchipperFastAPI:
         app: FastAPI,
         request_id_factory=None,
         blacklisted_headers=BLACKLISTED_HEADERS,
+        allowed_headers: Optional[Collection[str]] = None,
+        ignored_headers: Collection[str] = (),
+        streaming_metrics: bool = False,
+        websockets: bool = False,
+        websocket_message_sample_rate: int = 0,
+        lifespan: bool = False,
     ):
+        if websocket_message_sample_rate < 0:
+            raise ValueError("websocket_message_sample_rate must not be negative.")
         self._app = app
+        self._streaming_metrics = streaming_metrics
+        self._websockets = websockets
+        self._websocket_message_sample_rate = websocket_message_sample_rate
+        self._lifespan = lifespan
         self._blacklisted_headers = blacklisted_headers
+        self._allowed_headers = allowed_headers
+        self._ignored_headers = ignored_headers
         self._request_id_factory = request_id_factory
+        self._header_keys = ContextKeys(
+            "http.header.", masked=blacklisted_headers, allowed=allowed_headers, ignored=ignored_headers
+        )
+        self._query_param_keys = ContextKeys("http.query_param.")
 
-    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    def _request_context(self, scope: Scope) -> Dict[str, Any]:
+        """Build the request's context keys straight from the ASGI scope, without building a Starlette Request."""
+        request_context: Dict[str, Any] = {
+            "http.id": self._request_id_factory() if self._request_id_factory is not None else str(uuid.uuid4()),
+            "http.body_size": 0,
+            "http.method": scope["method"],
+            "http.path": None,
+        }
         # When the request object parses query params it doesn't combine repeat
         # params into a list. This doesn't happen until FastAPI is preparing to
         # call the handling function. We do want to see repeat params as a list so
         # we combine them here.
-        if scope["type"] != "http":
+        query_string = scope.get("query_string")
+        if query_string:
+            add_query_params(query_string.decode("latin-1"), self._query_param_keys, request_context)
+
+        request_context["http.path"] = _request_path(scope, self._add_headers(scope, request_context))
+        return request_context
+
+    def _websocket_context(self, scope: Scope) -> Dict[str, Any]:
+        websocket_context: Dict[str, Any] = {
+            "websocket.id": self._request_id_factory() if self._request_id_factory is not None else str(uuid.uuid4()),
+            "websocket.path": None,
+        }
+        # A WebSocket handshake has no body, so a content-length header is not taken as its size
+        websocket_context["websocket.path"] = _request_path(
+            scope, self._add_headers(scope, websocket_context, body_size=False)
+        )
+        return websocket_context
+
+    def _add_headers(self, scope: Scope, context: Dict[str, Any], body_size: bool = True) -> Optional[bytes]:
+        """Add the logged headers of the scope to the context, along with the size of the body given by the
+        content-length header if `body_size`, and return the value of the host header."""
+        host = None
+        for name, value in scope["headers"]:
+            if name == b"host":
+                host = value
+            elif body_size and name == b"content-length":
+                try:
+                    context["http.body_size"] = int(value)
+                except ValueError:
+                    pass
+            entry = self._header_keys.lookup(name)
+            if entry is not None:
+                context[entry[0]] = MASK if entry[1] else value.decode("latin-1")
+        return host
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scope_type = scope["type"]
+        if scope_type != "http":
+            if scope_type == "websocket" and self._websockets:
+                return await self._call_websocket(scope, receive, send)
+            if scope_type == "lifespan" and self._lifespan:
+                return await self._call_lifespan(scope, receive, send)
             return await self._app(scope, receive, send)
-        request = Request(scope)
-        queries = {}
-        for k, v in request.query_params.multi_items():
-            if k in queries and not isinstance(queries[k], list):
-                queries[k] = [queries[k], v]
-            elif k in queries:
-                queries[k].append(v)
-            else:
-                queries[k] = v
+        if self._streaming_metrics:
+            return await self._call_with_streaming_metrics(scope, receive, send)
 
         async def send_with_extra_headers(message):
             if message["type"] == "http.response.start":
                 logging_ctx.update(
                     {
                         "http.response.status_code": message["status"],
-                        "http.response.content_length": int(dict(message["headers"]).get(b"content-length", 0)),
+                        "http.response.content_length": _content_length(message.get("headers", ())),
                     }
                 )
             return await send(message)
 
-        with LoggingContext(
-            "fastapi:request",
-            **{
-                "id": self._request_id_factory() if self._request_id_factory is not None else str(uuid.uuid4()),
-                "body_size": int(request.headers.get("content-length", 0)),
-                "method": request.method,
-                "path": str(request.base_url)[:-1] + request.url.path if request.url.path else request.base_url,
-                **{f"query_param.{k.lower()}": v for k, v in queries.items()},
-                **{
-                    f"header.{k.lower()}": (v if k.lower() not in self._blacklisted_headers else "******")
-                    for k, v in request.headers.items()
-                },
-            },
-            _prefix="http",
-        ):
+        # The keys are built with their prefix already
+        with LoggingContext("fastapi:request", _prefix=None, **self._request_context(scope)):
             try:
                 await self._app(scope, receive, send_with_extra_headers)
             except Exception:
                 logging_ctx.update({"http.response.status_code": 500})
                 raise
 
+    async def _call_with_streaming_metrics(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Track the response with counters only, so that streamed responses cost no context updates per chunk, and
+        write them to the context once the response is complete."""
+        stats = _ResponseStats()
+
+        async def receive_tracking_disconnect():
+            message = await receive()
+            # Servers also report a disconnect once the response is complete, which is no interruption
+            if message["type"] == "http.disconnect" and not stats.completed:
+                stats.disconnected = True
+            return message
+
+        async def send_tracking_response(message):
+            message_type = message["type"]
+            if message_type == "http.response.body":
+                stats.body_bytes += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    stats.completed = True
+            elif message_type == "http.response.start":
+                stats.ttfb_ns = time.perf_counter_ns() - stats.started_at_ns
+                stats.status_code = message["status"]
+                stats.content_length = _content_length(message.get("headers", ()))
+            return await send(message)
+
+        with LoggingContext("fastapi:request", _prefix=None, **self._request_context(scope)):
+            try:
+                await self._app(scope, receive_tracking_disconnect, send_tracking_response)
+            except asyncio.CancelledError:
+                stats.cancelled = True
+                raise
+            except Exception:
+                stats.status_code = 500
+                raise
+            finally:
+                logging_ctx.update(stats.as_context())
+
+    async def _call_websocket(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Wrap the WebSocket session in a context, counting the messages and bytes that pass in each direction. One
+        of every `websocket_message_sample_rate` messages received is also logged on its own. The messages are only
+        counted, never wrapped in a context, so the app may receive them from any task."""
+        stats = _WebSocketStats()
+        sample_rate = self._websocket_message_sample_rate
+
+        async def receive_counting_messages():
+            message = await receive()
+            message_type = message["type"]
+            if message_type == "websocket.receive":
+                size = _message_size(message)
+                stats.messages_received += 1
+                stats.bytes_received += size
+                if sample_rate and (stats.messages_received - 1) % sample_rate == 0:
+                    logger.info(
+                        "WebSocket message received.",
+                        **{"websocket.message.index": stats.messages_received, "websocket.message.bytes": size},
+                    )
+            elif message_type == "websocket.disconnect":
+                stats.close_code = message.get("code", 1000)
+            return message
+
+        async def send_counting_messages(message):
+            message_type = message["type"]
+            if message_type == "websocket.send":
+                stats.messages_sent += 1
+                stats.bytes_sent += _message_size(message)
+            elif message_type == "websocket.accept":
+                stats.accepted = True
+            elif message_type == "websocket.close":
+                stats.close_code = message.get("code", 1000)
+            return await send(message)
+
+        with LoggingContext("fastapi:websocket", _prefix=None, **self._websocket_context(scope)):
+            try:
+                await self._app(scope, receive_counting_messages, send_counting_messages)
+            finally:
+                logging_ctx.update(stats.as_context())
+
+    async def _call_lifespan(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Log how long the application took to start up and to shut down."""
+        started_at_ns = 0
+
+        async def receive_timing_phase():
+            nonlocal started_at_ns
+            message = await receive()
+            started_at_ns = time.perf_counter_ns()
+            return message
+
+        async def send_phase_duration(message):
+            # The messages are lifespan.startup.complete, lifespan.shutdown.failed and so on
+            _, phase, outcome = message["type"].split(".", 2)
+            elapsed_musec = (time.perf_counter_ns() - started_at_ns) // 1000
+            if outcome == "complete":
+                logger.info(f"Lifespan {phase} complete.", **{f"lifespan.{phase}_musec": elapsed_musec})
+            else:
+                logger.error(
+                    f"Lifespan {phase} failed.",
+                    **{f"lifespan.{phase}_musec": elapsed_musec, "lifespan.message": message.get("message", "")},
+                )
+            return await send(message)
+
+        await self._app(scope, receive_timing_phase, send_phase_duration)
+
     def __build_middleware_stack__(self) -> ASGIApp:
         asgi_app = self._app.__orig_build_middleware_stack__()
         return type(self)(
-            asgi_app, request_id_factory=self._request_id_factory, blacklisted_headers=self._blacklisted_headers
+            asgi_app,
+            request_id_factory=self._request_id_factory,
+            blacklisted_headers=self._blacklisted_headers,
+            allowed_headers=self._allowed_headers,
+            ignored_headers=self._ignored_headers,
+            streaming_metrics=self._streaming_metrics,
+            websockets=self._websockets,
+            websocket_message_sample_rate=self._websocket_message_sample_rate,
+            lifespan=self._lifespan,
         )
 
     def chipperize(self):
@@ -1,42 +1,73 @@
 import uuid
+from typing import Any, Collection, Dict, Optional
 
 from flask import g, request
 
 from woodchipper.context import LoggingContext, logging_ctx
+from woodchipper.http import ContextKeys, EnvironHeaderKeys, compile_excluded_paths
 
 BLACKLISTED_HEADERS = ["authorization", "cookie"]
 
 
 class WoodchipperFlask:
-    def __init__(self, app, blacklisted_headers=BLACKLISTED_HEADERS, request_id_factory=None):
+    def __init__(
+        self,
+        app,
+        blacklisted_headers=BLACKLISTED_HEADERS,
+        request_id_factory=None,
+        allowed_headers: Optional[Collection[str]] = None,
+        ignored_headers: Collection[str] = (),
+        excluded_paths: Collection[str] = (),
+        excluded_endpoints: Collection[str] = (),
+        defer_headers: bool = False,
+    ):
         self._app = app
         self._blacklisted_headers = blacklisted_headers
         self._request_id_factory = request_id_factory or (lambda: str(uuid.uuid4()))
+        self._header_keys = ContextKeys(
+            "http.header.", masked=blacklisted_headers, allowed=allowed_headers, ignored=ignored_headers
+        )
+        self._query_param_keys = ContextKeys("http.query_param.")
+        self._environ_header_keys = EnvironHeaderKeys(self._header_keys)
+        self._excluded_paths = compile_excluded_paths(excluded_paths)
+        self._excluded_endpoints = frozenset(excluded_endpoints)
+        self._defer_headers = defer_headers
         self.vanilla_full_dispatch_request = app.full_dispatch_request
 
+    def _is_excluded(self) -> bool:
+        if self._excluded_endpoints and request.endpoint in self._excluded_endpoints:
+            return True
+        return self._excluded_paths is not None and self._excluded_paths.fullmatch(request.path) is not None
+
+    def _header_context(self) -> Dict[str, Any]:
+        # Read straight from the environ, rather than through request.headers, which rebuilds every header name
+        header_context: Dict[str, Any] = {}
+        self._environ_header_keys.add_headers(request.environ, header_context)
+        return header_context
+
+    def _request_context(self) -> Dict[str, Any]:
+        request_context: Dict[str, Any] = {
+            "http.id": g.request_id,
+            "http.body_size": request.content_length,
+            "http.method": request.method,
+            "http.path": request.base_url,
+        }
+        for param_key, param_val_list in request.args.lists():
+            entry = self._query_param_keys.lookup(param_key)
+            if entry is not None:
+                request_context[entry[0]] = param_val_list[0] if len(param_val_list) == 1 else param_val_list
+        if not self._defer_headers:
+            request_context.update(self._header_context())
+        return request_context
+
     def wrapped_full_dispatch_request(self):
+        if self._is_excluded():
+            return self.vanilla_full_dispatch_request()
         if not getattr(g, "request_id", None):
-            g.request_id = self._request_id_factory()
-        with LoggingContext(
-            "flask:request",
-            **{
-                "id": g.request_id,
-                "body_size": request.content_length,
-                "method": request.method,
-                "path": request.base_url,
-                **{
-                    f"query_param.{param_key.lower()}": param_val_list[0]
-                    if len(param_val_list) == 1
-                    else param_val_list
-                    for param_key, param_val_list in request.args.lists()
-                },
-                **{
-                    f"header.{header.lower()}": ("******" if header.lower() in self._blacklisted_headers else value)
-                    for header, value in request.headers.items()
-                },
-            },
-            _prefix="http",
-        ):
+            # Reuse the ID of the request given by WoodchipperWSGI, if the app is wrapped in it as well
+            g.request_id = request.environ.get("woodchipper.request_id") or self._request_id_factory()
+        # The keys are built with their prefix already
+        with LoggingContext("flask:request", _prefix=None, **self._request_context()):
             try:
                 response = self.vanilla_full_dispatch_request()
             except Exception:
@@ -46,6 +77,7 @@ class WoodchipperFlask:
                 logging_ctx.update(
                     {
                         "http.response.status_code": 500,
+                        **(self._header_context() if self._defer_headers else {}),
                     }
                 )
                 raise
@@ -54,6 +86,7 @@ class WoodchipperFlask:
                     {
                         "http.response.status_code": response.status_code,
                         "http.response.content_length": response.content_length,
+                        **(self._header_context() if self._defer_headers and response.status_code >= 500 else {}),
                     }
                 )
                 return response
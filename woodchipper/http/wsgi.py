@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import uuid
+from typing import Any, Collection, Dict, Iterable, Optional, Sized
+from wsgiref.util import request_uri
+
+from woodchipper.context import LoggingContext, logging_ctx
+from woodchipper.http import ContextKeys, EnvironHeaderKeys, add_query_params, compile_excluded_paths
+
+BLACKLISTED_HEADERS = ["authorization", "cookie"]
+
+
+def _remaining_size(filelike) -> Optional[int]:
+    """The bytes left to read in a file, or None if it isn't a regular file."""
+    try:
+        return os.fstat(filelike.fileno()).st_size - filelike.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class _ClosingFile:
+    """
+    Stands in for the file of a wsgi.file_wrapper response in the server's own file_wrapper, so the
+    server can still send it with sendfile, and closes the response along with the file.
+    """
+
+    __slots__ = ("_file", "_response")
+
+    def __init__(self, file, response: "_ClosingResponse"):
+        self._file = file
+        self._response = response
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._response.close()
+
+
+class _ClosingResponse:
+    """
+    Wraps the response iterable of the app to count the bytes handed to the server, and exits the
+    request's context when the server closes the response, after the last byte has been written.
+    """
+
+    __slots__ = (
+        "_iterable",
+        "_iterator",
+        "_context",
+        "started_at_ns",
+        "status_code",
+        "content_length",
+        "ttfb_ns",
+        "body_bytes",
+        "exhausted",
+        "exc_info",
+        "closed",
+    )
+
+    def __init__(self, context: LoggingContext):
+        self._iterable: Optional[Iterable[bytes]] = None
+        self._iterator = None
+        self._context = context
+        self.started_at_ns = time.perf_counter_ns()
+        self.status_code: Optional[int] = None
+        self.content_length: Optional[int] = None
+        self.ttfb_ns: Optional[int] = None
+        self.body_bytes = 0
+        self.exhausted = False
+        self.exc_info = (None, None, None)
+        self.closed = False
+
+    def start_response(self, start_response):
+        def counting_start_response(status, headers, exc_info=None):
+            self.status_code = int(status[:3])
+            self.content_length = None
+            for name, value in headers:
+                if name.lower() == "content-length":
+                    try:
+                        self.content_length = int(value)
+                    except ValueError:
+                        pass
+                    break
+            write = start_response(status, headers, exc_info)
+
+            # Apps that write their body through the legacy write callable get it counted too
+            def counting_write(data):
+                self._count(data)
+                return write(data)
+
+            return counting_write
+
+        return counting_start_response
+
+    def _count(self, chunk: bytes):
+        if self.ttfb_ns is None and chunk:
+            self.ttfb_ns = time.perf_counter_ns() - self.started_at_ns
+        self.body_bytes += len(chunk)
+
+    def wrap(self, iterable: Iterable[bytes]) -> "_ClosingResponse":
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        if isinstance(iterable, Sized):
+            self.__class__ = _SizedClosingResponse
+        return self
+
+    def wrap_file(self, iterable, filelike, file_wrapper):
+        """
+        Hand the file of a wsgi.file_wrapper response to the server's file_wrapper again, rather than
+        iterating it, so the server can still send it with sendfile. The bytes the server sends itself
+        can't be counted, so the size left in the file is taken instead.
+        """
+        self._iterable = iterable
+        size = _remaining_size(filelike)
+        self.body_bytes = size if size is not None else self.content_length or 0
+        # wsgiref and gunicorn call the block size blksize, werkzeug buffer_size
+        block_size = getattr(iterable, "blksize", None) or getattr(iterable, "buffer_size", None) or 8192
+        return file_wrapper(_ClosingFile(filelike, self), block_size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self.exhausted = True
+            raise
+        except Exception:
+            self.exc_info = sys.exc_info()
+            raise
+        self._count(chunk)
+        return chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            close = getattr(self._iterable, "close", None)
+            if close is not None:
+                close()
+        except Exception:
+            self.exc_info = sys.exc_info()
+            raise
+        finally:
+            self.exit()
+
+    def exit(self):
+        failed = self.exc_info[0] is not None
+        logging_ctx.update(
+            {
+                "http.response.status_code": 500 if failed else self.status_code,
+                "http.response.content_length": self.content_length,
+                "http.response.ttfb_musec": self.ttfb_ns // 1000 if self.ttfb_ns is not None else None,
+                "http.response.body_bytes": self.body_bytes,
+                # The server stops iterating and closes the response early when the client goes away
+                "http.response.disconnected": not failed and self._iterator is not None and not self.exhausted,
+            }
+        )
+        self._context.__exit__(*self.exc_info)
+        self.exc_info = (None, None, None)
+
+
+class _SizedClosingResponse(_ClosingResponse):
+    """A _ClosingResponse wrapping an iterable with a length, which servers use to size single-item bodies."""
+
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self._iterable)
+
+
+class WoodchipperWSGI:
+    """
+    WSGI middleware that wraps each request in a LoggingContext, which stays open until the server
+    closes the response, so streamed responses, other middleware and the app's teardown are all
+    measured. Works with any WSGI app and server.
+    """
+
+    def __init__(
+        self,
+        app,
+        request_id_factory=None,
+        blacklisted_headers=BLACKLISTED_HEADERS,
+        allowed_headers: Optional[Collection[str]] = None,
+        ignored_headers: Collection[str] = (),
+        excluded_paths: Collection[str] = (),
+    ):
+        self._app = app
+        self._request_id_factory = request_id_factory or (lambda: str(uuid.uuid4()))
+        self._header_keys = EnvironHeaderKeys(
+            ContextKeys("http.header.", masked=blacklisted_headers, allowed=allowed_headers, ignored=ignored_headers)
+        )
+        self._query_param_keys = ContextKeys("http.query_param.")
+        self._excluded_paths = compile_excluded_paths(excluded_paths)
+
+    def _request_context(self, environ) -> Dict[str, Any]:
+        request_id = environ["woodchipper.request_id"] = self._request_id_factory()
+        try:
+            body_size: Optional[int] = int(environ.get("CONTENT_LENGTH") or 0) or None
+        except ValueError:
+            body_size = None
+        request_context: Dict[str, Any] = {
+            "http.id": request_id,
+            "http.body_size": body_size,
+            "http.method": environ.get("REQUEST_METHOD"),
+            "http.path": request_uri(environ, include_query=False),
+        }
+        query_string = environ.get("QUERY_STRING")
+        if query_string:
+            add_query_params(query_string, self._query_param_keys, request_context)
+        self._header_keys.add_headers(environ, request_context)
+        return request_context
+
+    def __call__(self, environ, start_response):
+        if self._excluded_paths is not None and self._excluded_paths.fullmatch(environ.get("PATH_INFO", "")):
+            return self._app(environ, start_response)
+        # The keys are built with their prefix already
+        context = LoggingContext("wsgi:request", _prefix=None, **self._request_context(environ))
+        context.__enter__()
+        response = _ClosingResponse(context)
+        try:
+            iterable = self._app(environ, response.start_response(start_response))
+        except Exception:
+            response.exc_info = sys.exc_info()
+            response.exit()
+            raise
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        filelike = getattr(iterable, "filelike", None) if file_wrapper is not None else None
+        if filelike is not None:
+            return response.wrap_file(iterable, filelike, file_wrapper)
+        return response.wrap(iterable)
@@ -1,9 +1,19 @@
-from typing import Dict
+import contextvars
+import threading
+from typing import Dict, Generic, Iterable, List, Tuple, Type, TypeVar
 
 from woodchipper.context import LoggableValue
 
+T = TypeVar("T")
+
 
 class BaseMonitor:
+    __slots__ = ()
+
+    # Whether instances may be reused by later contexts once finished, rather than a new instance being created for
+    # every context. Only safe if nothing, such as a task started in the context, can update a monitor after finish().
+    reusable: bool = False
+
     def __init__(self):
         raise NotImplementedError()
 
@@ -12,3 +22,69 @@ class BaseMonitor:
 
     def finish(self) -> Dict[str, LoggableValue]:
         raise NotImplementedError()
+
+    def finish_into(self, results: Dict[str, LoggableValue]):
+        """Finish, adding the results to `results`. Monitors can override it to skip building a dict of their own."""
+        results.update(self.finish())
+
+    def reset(self):
+        """Return a finished monitor to its initial state, before it is reused."""
+        self.__init__()
+
+    def suspend(self):
+        """Stop attributing measurements to the monitor while its context is suspended, as the context of an async
+        generator is while the consumer handles an item."""
+
+    def resume(self):
+        """Attribute measurements to the monitor again after suspend()."""
+
+
+# Finished reusable monitors of the current thread, by class
+_free_monitors = threading.local()
+MAX_FREE_MONITORS = 16
+
+
+def acquire_monitors(classes: Iterable[Type[BaseMonitor]]) -> List[BaseMonitor]:
+    """Return a monitor of each class for a context, reusing the finished monitors of the current thread if any."""
+    try:
+        free = _free_monitors.by_class
+    except AttributeError:
+        free = _free_monitors.by_class = {}
+    monitors = []
+    for cls in classes:
+        free_list = free.get(cls)
+        monitors.append(free_list.pop() if free_list else cls())
+    return monitors
+
+
+def release_monitors(monitors: Iterable[BaseMonitor]):
+    """Hand the finished monitors of a context back, to be reused by later contexts on the current thread if their
+    class allows it."""
+    try:
+        free = _free_monitors.by_class
+    except AttributeError:
+        free = _free_monitors.by_class = {}
+    for monitor in monitors:
+        if monitor.reusable:
+            free_list = free.setdefault(type(monitor), [])
+            if len(free_list) < MAX_FREE_MONITORS:
+                monitor.reset()
+                free_list.append(monitor)
+
+
+class ActiveMonitors(Generic[T]):
+    """Tracks the monitors active in the current context, innermost last. Instrumentation installed once per process
+    uses it to attribute each measurement to every enclosing LoggingContext, and only to those, even across threads
+    and asyncio tasks."""
+
+    def __init__(self, name: str):
+        self._var: contextvars.ContextVar[Tuple[T, ...]] = contextvars.ContextVar(name, default=())
+
+    def push(self, monitor: T) -> contextvars.Token:
+        return self._var.set(self._var.get() + (monitor,))
+
+    def pop(self, token: contextvars.Token):
+        self._var.reset(token)
+
+    def get(self) -> Tuple[T, ...]:
+        return self._var.get()
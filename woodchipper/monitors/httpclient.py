@@ -0,0 +1,235 @@
+import threading
+import time
+from functools import wraps
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from woodchipper.context import LoggableValue
+from woodchipper.monitors import ActiveMonitors, BaseMonitor
+
+_active_monitors: ActiveMonitors["HTTPClientMonitor"] = ActiveMonitors("woodchipper_http_client_monitors")
+_instrument_lock = threading.Lock()
+_instrumented = False
+
+
+class HostStats:
+    """The outbound calls made to one host within a context."""
+
+    __slots__ = ("call_count", "total_time_ns", "max_time_ns", "bytes_sent", "bytes_received", "error_count")
+
+    def __init__(self):
+        self.call_count = 0
+        self.total_time_ns = 0
+        self.max_time_ns = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error_count = 0
+
+
+def _body_size(body) -> int:
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    # Streamed and file bodies are not counted
+    return 0
+
+
+def _content_length(headers) -> int:
+    try:
+        return int(headers.get("content-length") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _record_call(host: str, elapsed_ns: int, bytes_sent: int, response_headers, status: Optional[int]):
+    bytes_received = _content_length(response_headers) if response_headers is not None else 0
+    # Calls that raised, or got a server error, count as errors
+    failed = status is None or status >= 500
+    for monitor in _active_monitors.get():
+        monitor._record_call(host, elapsed_ns, bytes_sent, bytes_received, failed)
+
+
+def _instrument_urllib3():
+    try:
+        from urllib3.connectionpool import HTTPConnectionPool
+    except ImportError:
+        return
+
+    make_request = HTTPConnectionPool._make_request
+
+    # A single attempt, so that retries and redirects are each counted as a call
+    @wraps(make_request)
+    def _make_request(self, conn, method, url, *args, **kwargs):
+        if not _active_monitors.get():
+            return make_request(self, conn, method, url, *args, **kwargs)
+        bytes_sent = _body_size(kwargs.get("body", args[0] if args else None))
+        response = None
+        started_at = time.perf_counter_ns()
+        try:
+            response = make_request(self, conn, method, url, *args, **kwargs)
+            return response
+        finally:
+            _record_call(
+                self.host,
+                time.perf_counter_ns() - started_at,
+                bytes_sent,
+                response.headers if response is not None else None,
+                response.status if response is not None else None,
+            )
+
+    HTTPConnectionPool._make_request = _make_request  # type: ignore[assignment]
+
+
+def _instrument_httpx():
+    try:
+        import httpx
+    except ImportError:
+        return
+
+    handle_request = httpx.HTTPTransport.handle_request
+    handle_async_request = httpx.AsyncHTTPTransport.handle_async_request
+
+    @wraps(handle_request)
+    def _handle_request(self, request):
+        if not _active_monitors.get():
+            return handle_request(self, request)
+        response = None
+        started_at = time.perf_counter_ns()
+        try:
+            response = handle_request(self, request)
+            return response
+        finally:
+            _record_call(
+                request.url.host,
+                time.perf_counter_ns() - started_at,
+                _content_length(request.headers),
+                response.headers if response is not None else None,
+                response.status_code if response is not None else None,
+            )
+
+    @wraps(handle_async_request)
+    async def _handle_async_request(self, request):
+        if not _active_monitors.get():
+            return await handle_async_request(self, request)
+        response = None
+        started_at = time.perf_counter_ns()
+        try:
+            response = await handle_async_request(self, request)
+            return response
+        finally:
+            _record_call(
+                request.url.host,
+                time.perf_counter_ns() - started_at,
+                _content_length(request.headers),
+                response.headers if response is not None else None,
+                response.status_code if response is not None else None,
+            )
+
+    httpx.HTTPTransport.handle_request = _handle_request  # type: ignore[assignment]
+    httpx.AsyncHTTPTransport.handle_async_request = _handle_async_request  # type: ignore[assignment]
+
+
+def _instrument_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        return
+
+    request = aiohttp.ClientSession._request
+
+    @wraps(request)
+    async def _request(self, method, str_or_url, *args, **kwargs):
+        if not _active_monitors.get():
+            return await request(self, method, str_or_url, *args, **kwargs)
+        response = None
+        started_at = time.perf_counter_ns()
+        try:
+            response = await request(self, method, str_or_url, *args, **kwargs)
+            return response
+        finally:
+            _record_call(
+                response.url.host if response is not None else (urlsplit(str(str_or_url)).hostname or ""),
+                time.perf_counter_ns() - started_at,
+                _body_size(kwargs.get("data")),
+                response.headers if response is not None else None,
+                response.status if response is not None else None,
+            )
+
+    aiohttp.ClientSession._request = _request  # type: ignore[assignment]
+
+
+def instrument_http_clients():
+    """Wraps the request methods of the installed HTTP client libraries, once for the life of the process."""
+    global _instrumented
+    if _instrumented:
+        return
+    with _instrument_lock:
+        if _instrumented:
+            return
+        _instrument_urllib3()
+        _instrument_httpx()
+        _instrument_aiohttp()
+        _instrumented = True
+
+
+class HTTPClientMonitor(BaseMonitor):
+    __slots__ = ("hosts", "_token")
+
+    # Number of distinct hosts reported per context. Calls to further hosts are reported under `other_host_name`.
+    max_hosts: int = 10
+    other_host_name: str = "other"
+
+    def __init__(self):
+        self.hosts: Dict[str, HostStats] = {}
+        self._token = None
+
+    def _record_call(self, host: str, elapsed_ns: int, bytes_sent: int, bytes_received: int, failed: bool):
+        stats = self.hosts.get(host)
+        if stats is None:
+            if len(self.hosts) >= self.max_hosts:
+                host = self.other_host_name
+                stats = self.hosts.get(host)
+            if stats is None:
+                stats = self.hosts[host] = HostStats()
+        stats.call_count += 1
+        stats.total_time_ns += elapsed_ns
+        if elapsed_ns > stats.max_time_ns:
+            stats.max_time_ns = elapsed_ns
+        stats.bytes_sent += bytes_sent
+        stats.bytes_received += bytes_received
+        if failed:
+            stats.error_count += 1
+
+    def setup(self):
+        instrument_http_clients()
+        self._token = _active_monitors.push(self)
+
+    def finish(self) -> Dict[str, LoggableValue]:
+        results: Dict[str, LoggableValue] = {}
+        self.finish_into(results)
+        return results
+
+    def finish_into(self, results: Dict[str, LoggableValue]):
+        if self._token is not None:
+            _active_monitors.pop(self._token)
+            self._token = None
+        hosts = self.hosts.values()
+        results["http_client.call_count"] = sum(stats.call_count for stats in hosts)
+        results["http_client.total_time_musec"] = sum(stats.total_time_ns for stats in hosts) // 1000
+        results["http_client.error_count"] = sum(stats.error_count for stats in hosts)
+        for host, stats in self.hosts.items():
+            results[f"http_client.host.{host}.call_count"] = stats.call_count
+            results[f"http_client.host.{host}.total_time_musec"] = stats.total_time_ns // 1000
+            results[f"http_client.host.{host}.max_time_musec"] = stats.max_time_ns // 1000
+            results[f"http_client.host.{host}.bytes_sent"] = stats.bytes_sent
+            results[f"http_client.host.{host}.bytes_received"] = stats.bytes_received
+            results[f"http_client.host.{host}.error_count"] = stats.error_count
+
+    def suspend(self):
+        if self._token is not None:
+            _active_monitors.pop(self._token)
+
+    def resume(self):
+        if self._token is not None:
+            self._token = _active_monitors.push(self)
@@ -0,0 +1,139 @@
+import gc
+import os
+import time
+import tracemalloc
+from typing import Dict, Optional
+
+from woodchipper.context import LoggableValue
+from woodchipper.monitors import ActiveMonitors, BaseMonitor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None  # type: ignore[assignment]
+
+_RUSAGE_WHO = getattr(resource, "RUSAGE_THREAD", getattr(resource, "RUSAGE_SELF", None))
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_active_monitors: ActiveMonitors["ResourceMonitor"] = ActiveMonitors("woodchipper_resource_monitors")
+
+
+class _GCStats:
+    """Garbage collections and the time spent in them, process-wide, since the callback was installed."""
+
+    def __init__(self):
+        self.collections = 0
+        self.pause_ns = 0
+        self._started_at = 0
+        self.installed = False
+
+    def callback(self, phase, info):
+        if phase == "start":
+            self._started_at = time.perf_counter_ns()
+        elif self._started_at:
+            self.collections += 1
+            self.pause_ns += time.perf_counter_ns() - self._started_at
+            self._started_at = 0
+
+
+_gc_stats = _GCStats()
+
+
+def _install_gc_callback():
+    """Registers the garbage collection callback, once for the life of the process."""
+    if not _gc_stats.installed:
+        _gc_stats.installed = True
+        gc.callbacks.append(_gc_stats.callback)
+
+
+def _read_rss() -> Optional[int]:
+    """The resident set size of the process in bytes, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _fold_traced_peak():
+    """Credits the peak of traced memory since the last reset to every active monitor, then resets it, so that nested
+    contexts each see the peak reached while they were open."""
+    peak = tracemalloc.get_traced_memory()[1]
+    for monitor in _active_monitors.get():
+        if peak > monitor.traced_peak:
+            monitor.traced_peak = peak
+    tracemalloc.reset_peak()
+
+
+class ResourceMonitor(BaseMonitor):
+    __slots__ = (
+        "rss_start",
+        "gc_collections_start",
+        "gc_pause_start_ns",
+        "rusage_start",
+        "traced_start",
+        "traced_peak",
+        "_token",
+    )
+
+    # Trace Python memory allocations with tracemalloc to report the peak allocated during each context. Tracing slows
+    # down every allocation, so it is off by default.
+    trace_allocations: bool = False
+
+    def __init__(self):
+        self.rss_start: Optional[int] = None
+        self.gc_collections_start = 0
+        self.gc_pause_start_ns = 0
+        self.rusage_start = None
+        self.traced_start = 0
+        self.traced_peak = 0
+        self._token = None
+
+    def setup(self):
+        _install_gc_callback()
+        self.rss_start = _read_rss()
+        self.gc_collections_start = _gc_stats.collections
+        self.gc_pause_start_ns = _gc_stats.pause_ns
+        if _RUSAGE_WHO is not None:
+            self.rusage_start = resource.getrusage(_RUSAGE_WHO)
+        # Measuring the peak per context needs tracemalloc.reset_peak, from Python 3.9
+        if self.trace_allocations and hasattr(tracemalloc, "reset_peak"):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _fold_traced_peak()
+            self.traced_start = self.traced_peak = tracemalloc.get_traced_memory()[0]
+            self._token = _active_monitors.push(self)
+
+    def finish(self) -> Dict[str, LoggableValue]:
+        results: Dict[str, LoggableValue] = {}
+        self.finish_into(results)
+        return results
+
+    def finish_into(self, results: Dict[str, LoggableValue]):
+        results["resources.gc_collections"] = _gc_stats.collections - self.gc_collections_start
+        results["resources.gc_pause_musec"] = (_gc_stats.pause_ns - self.gc_pause_start_ns) // 1000
+        if self.rss_start is not None:
+            rss = _read_rss()
+            if rss is not None:
+                results["resources.rss_delta_kib"] = (rss - self.rss_start) // 1024
+        if self.rusage_start is not None:
+            usage = resource.getrusage(_RUSAGE_WHO)
+            results["resources.voluntary_context_switches"] = usage.ru_nvcsw - self.rusage_start.ru_nvcsw
+            results["resources.involuntary_context_switches"] = usage.ru_nivcsw - self.rusage_start.ru_nivcsw
+        if self._token is not None:
+            _fold_traced_peak()
+            _active_monitors.pop(self._token)
+            self._token = None
+            results["resources.traced_peak_kib"] = (self.traced_peak - self.traced_start) // 1024
+
+    def suspend(self):
+        if self._token is not None:
+            # The peak reached so far is credited before the monitor stops seeing allocations
+            _fold_traced_peak()
+            _active_monitors.pop(self._token)
+
+    def resume(self):
+        if self._token is not None:
+            # And the peak reached in between only to the monitors active meanwhile
+            _fold_traced_peak()
+            self._token = _active_monitors.push(self)
@@ -1,40 +1,275 @@
+import heapq
+import re
+import threading
 import time
-from typing import Callable, Optional
+import weakref
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
 
-from sqlalchemy import engine, event
+from sqlalchemy import engine, event, pool
 
-from woodchipper.monitors import BaseMonitor
+from woodchipper.context import LoggableValue
+from woodchipper.monitors import ActiveMonitors, BaseMonitor
+
+_QUERY_START_KEY = "woodchipper_query_start"
+
+_active_monitors: ActiveMonitors["SQLAlchemyMonitor"] = ActiveMonitors("woodchipper_sqlalchemy_monitors")
+_instrumented_engines: "weakref.WeakSet[engine.Engine]" = weakref.WeakSet()
+_instrument_lock = threading.Lock()
+
+_active_pool_monitors: ActiveMonitors["SQLAlchemyPoolMonitor"] = ActiveMonitors("woodchipper_sqlalchemy_pool_monitors")
+_instrumented_pools: "weakref.WeakSet[pool.Pool]" = weakref.WeakSet()
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"\?|%s|%\(\w+\)s|(?<!:):\w+|\$\d+")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LIST_RE = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint_statement(statement: str) -> str:
+    """Normalize a SQL statement so that executions differing only in their literal values, bind parameter style or
+    the length of their IN-lists share a fingerprint. `SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x'` becomes
+    `SELECT * FROM t WHERE id IN (...) AND name = ?`."""
+    fingerprint = _COMMENT_RE.sub(" ", statement)
+    fingerprint = _STRING_LITERAL_RE.sub("?", fingerprint)
+    fingerprint = _NUMBER_LITERAL_RE.sub("?", fingerprint)
+    fingerprint = _PLACEHOLDER_RE.sub("?", fingerprint)
+    fingerprint = _IN_LIST_RE.sub("IN (...)", fingerprint)
+    fingerprint = _VALUES_LIST_RE.sub(r"\1, ...", fingerprint)
+    return _WHITESPACE_RE.sub(" ", fingerprint).strip()
+
+
+class StatementStats:
+    """The executions of one statement fingerprint within a context."""
+
+    __slots__ = ("count", "total_time_ns", "max_time_ns")
+
+    def __init__(self):
+        self.count = 0
+        self.total_time_ns = 0
+        self.max_time_ns = 0
+
+
+def _handle_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_monitors.get():
+        conn.info.setdefault(_QUERY_START_KEY, []).append(time.perf_counter_ns())
+
+
+def _handle_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info.get(_QUERY_START_KEY)
+    if not started_at:
+        return
+    exec_time_ns = time.perf_counter_ns() - started_at.pop()
+    fingerprint = None
+    for monitor in _active_monitors.get():
+        monitor.total_db_time_ns += exec_time_ns
+        monitor.statement_count += 1
+        if monitor.fingerprint_statements:
+            if fingerprint is None:
+                fingerprint = fingerprint_statement(statement)
+            monitor._record_statement(fingerprint, exec_time_ns)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute, so drop its start time to keep the stack aligned
+    conn = exception_context.connection
+    started_at = conn.info.get(_QUERY_START_KEY) if conn is not None else None
+    if started_at:
+        started_at.pop()
+
+
+def _instrument_engine(sa_engine: engine.Engine):
+    """Registers the statement timing listeners on an engine, once for the life of the engine."""
+    if sa_engine in _instrumented_engines:
+        return
+    with _instrument_lock:
+        if sa_engine in _instrumented_engines:
+            return
+        event.listen(sa_engine, "before_cursor_execute", _handle_before_cursor_execute)
+        event.listen(sa_engine, "after_cursor_execute", _handle_after_cursor_execute)
+        event.listen(sa_engine, "handle_error", _handle_error)
+        _instrumented_engines.add(sa_engine)
 
 
 class SQLAlchemyMonitor(BaseMonitor):
+    __slots__ = ("statement_count", "total_db_time_ns", "engine", "statements", "untracked_statement_count", "_token")
+
     statement_count: int
-    last_statement_started_at: Optional[float]
-    total_db_time: float
+    total_db_time_ns: int
     engine: engine.Engine
-    instance_setup_cb: Optional[Callable]
+    instance_setup_cb: Optional[Callable] = None
+    # Aggregate statements by fingerprint, to report the slowest ones and likely N+1 query patterns
+    fingerprint_statements: bool = False
+    # Number of slowest fingerprints, by total time, to report
+    top_statements: int = 3
+    # Number of distinct fingerprints tracked per context. Statements beyond it are only counted in the totals.
+    max_fingerprints: int = 100
+    # A fingerprint executed more than this many times in a context is reported as a possible N+1 query
+    n_plus_one_threshold: int = 10
 
     def __init__(self):
         self.statement_count = 0
-        self.last_statement_started_at = None
-        self.total_db_time = 0.0
+        self.total_db_time_ns = 0
+        self.statements: Dict[str, StatementStats] = {}
+        self.untracked_statement_count = 0
+        self._token = None
+
+    def _record_statement(self, fingerprint: str, exec_time_ns: int):
+        stats = self.statements.get(fingerprint)
+        if stats is None:
+            if len(self.statements) >= self.max_fingerprints:
+                self.untracked_statement_count += 1
+                return
+            stats = self.statements[fingerprint] = StatementStats()
+        stats.count += 1
+        stats.total_time_ns += exec_time_ns
+        if exec_time_ns > stats.max_time_ns:
+            stats.max_time_ns = exec_time_ns
+
+    def _add_fingerprint_results(self, results: Dict[str, LoggableValue]):
+        results["sql.fingerprint_count"] = len(self.statements)
+        if self.untracked_statement_count:
+            results["sql.untracked_statement_count"] = self.untracked_statement_count
+        slowest: List = heapq.nlargest(
+            self.top_statements, self.statements.items(), key=lambda item: item[1].total_time_ns
+        )
+        for rank, (fingerprint, stats) in enumerate(slowest, start=1):
+            results[f"sql.slowest.{rank}.statement"] = fingerprint
+            results[f"sql.slowest.{rank}.count"] = stats.count
+            results[f"sql.slowest.{rank}.total_time_musec"] = stats.total_time_ns // 1000
+            results[f"sql.slowest.{rank}.max_time_musec"] = stats.max_time_ns // 1000
+        if self.statements:
+            fingerprint, stats = max(self.statements.items(), key=lambda item: item[1].count)
+            if stats.count > self.n_plus_one_threshold:
+                results["sql.n_plus_one.statement"] = fingerprint
+                results["sql.n_plus_one.count"] = stats.count
 
-    def handle_before_event(self, conn, cursor, statement, parameters, context, executemany):
-        self.last_statement_started_at = time.time()
+    def setup(self):
+        if self.instance_setup_cb is not None:
+            self.instance_setup_cb()
+        _instrument_engine(self.engine)
+        self._token = _active_monitors.push(self)
+
+    def finish(self) -> Dict[str, LoggableValue]:
+        results: Dict[str, LoggableValue] = {}
+        self.finish_into(results)
+        return results
+
+    def finish_into(self, results: Dict[str, LoggableValue]):
+        if self._token is not None:
+            _active_monitors.pop(self._token)
+            self._token = None
+        results["sql.statement_count"] = self.statement_count
+        results["sql.total_db_time_musec"] = self.total_db_time_ns // 1000
+        if self.fingerprint_statements:
+            self._add_fingerprint_results(results)
+
+    def suspend(self):
+        if self._token is not None:
+            _active_monitors.pop(self._token)
+
+    def resume(self):
+        if self._token is not None:
+            self._token = _active_monitors.push(self)
+
+
+def _instrument_pool(sa_pool: pool.Pool):
+    """Times connection checkouts and tracks the connections in use of a pool, once for the life of the pool. The
+    pool has no event that fires before a checkout starts, so its `connect` method is wrapped to time the wait."""
+    if sa_pool in _instrumented_pools:
+        return
+    with _instrument_lock:
+        if sa_pool in _instrumented_pools:
+            return
+        usage_lock = threading.Lock()
+        checked_out = 0
+        pool_connect = sa_pool.connect
+
+        def connect(*args, **kwargs):
+            monitors = _active_pool_monitors.get()
+            if not monitors:
+                return pool_connect(*args, **kwargs)
+            started_at = time.perf_counter_ns()
+            try:
+                return pool_connect(*args, **kwargs)
+            finally:
+                wait_time_ns = time.perf_counter_ns() - started_at
+                for monitor in monitors:
+                    monitor.checkout_count += 1
+                    monitor.checkout_wait_ns += wait_time_ns
+
+        def handle_connect(dbapi_connection, connection_record):
+            for monitor in _active_pool_monitors.get():
+                monitor.connect_count += 1
 
-    def handle_after_event(self, conn, cursor, statement, parameters, context, executemany):
-        assert self.last_statement_started_at
-        exec_time = time.time() - self.last_statement_started_at
-        self.last_statement_started_at = None
-        self.total_db_time += exec_time
-        self.statement_count += 1
+        def handle_checkout(dbapi_connection, connection_record, connection_proxy):
+            nonlocal checked_out
+            with usage_lock:
+                checked_out += 1
+                in_use = checked_out
+            for monitor in _active_pool_monitors.get():
+                if in_use > monitor.peak_checked_out:
+                    monitor.peak_checked_out = in_use
+
+        def handle_checkin(dbapi_connection, connection_record):
+            nonlocal checked_out
+            with usage_lock:
+                # Connections checked out before the pool was instrumented are returned uncounted
+                checked_out = max(checked_out - 1, 0)
+
+        sa_pool.connect = connect  # type: ignore[assignment]
+        event.listen(sa_pool, "connect", handle_connect)
+        event.listen(sa_pool, "checkout", handle_checkout)
+        event.listen(sa_pool, "checkin", handle_checkin)
+        _instrumented_pools.add(sa_pool)
+
+
+class SQLAlchemyPoolMonitor(BaseMonitor):
+    __slots__ = ("checkout_count", "checkout_wait_ns", "connect_count", "peak_checked_out", "engine", "_token")
+
+    checkout_count: int
+    checkout_wait_ns: int
+    connect_count: int
+    peak_checked_out: int
+    engine: engine.Engine
+    instance_setup_cb: Optional[Callable] = None
+
+    def __init__(self):
+        self.checkout_count = 0
+        self.checkout_wait_ns = 0
+        self.connect_count = 0
+        self.peak_checked_out = 0
+        self._token = None
 
     def setup(self):
         if self.instance_setup_cb is not None:
             self.instance_setup_cb()
-        event.listen(self.engine, "before_cursor_execute", self.handle_before_event)
-        event.listen(self.engine, "after_cursor_execute", self.handle_after_event)
+        # Disposing of an engine replaces its pool, so the current pool is looked up on every setup
+        _instrument_pool(self.engine.pool)
+        self._token = _active_pool_monitors.push(self)
+
+    def finish(self) -> Dict[str, LoggableValue]:
+        results: Dict[str, LoggableValue] = {}
+        self.finish_into(results)
+        return results
+
+    def finish_into(self, results: Dict[str, LoggableValue]):
+        if self._token is not None:
+            _active_pool_monitors.pop(self._token)
+            self._token = None
+        results["sql.pool.checkout_count"] = self.checkout_count
+        results["sql.pool.checkout_wait_musec"] = self.checkout_wait_ns // 1000
+        results["sql.pool.connect_count"] = self.connect_count
+        results["sql.pool.peak_checked_out"] = self.peak_checked_out
+
+    def suspend(self):
+        if self._token is not None:
+            _active_pool_monitors.pop(self._token)
 
-    def finish(self):
-        event.remove(self.engine, "before_cursor_execute", self.handle_before_event)
-        event.remove(self.engine, "after_cursor_execute", self.handle_after_event)
-        return {"sql.statement_count": self.statement_count, "sql.total_db_time_musec": int(self.total_db_time * 1e6)}
+    def resume(self):
+        if self._token is not None:
+            self._token = _active_pool_monitors.push(self)
@@ -1,6 +1,14 @@
 import json
 import logging
+import os
+import threading
+import time
+from collections import ChainMap
+from typing import Any, Callable, Collection, Dict, Mapping, Optional, Tuple
 
+import structlog
+
+import woodchipper
 from woodchipper import context
 
 _ddtrace_present = False
@@ -24,21 +32,125 @@ def inject_context_processor(logger: logging.Logger, method: str, event_dict: di
     return ctx_items
 
 
+class ContextEventDict(ChainMap):
+    """
+    An event dict that layers the log event over the logging context without copying the context.
+    Writes, pops and deletes apply to the event layer only. The context is copied once, when the
+    event dict is materialized for rendering by materialize_context_processor.
+    """
+
+    def to_dict(self) -> dict:
+        event_dict, ctx_items = self.maps[0], self.maps[1]
+        if isinstance(ctx_items, context.PersistentContextMap):
+            merged = ctx_items.to_dict()
+        else:
+            merged = dict(ctx_items)
+        merged.update(event_dict)
+        return merged
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def lazy_inject_context_processor(logger: logging.Logger, method: str, event_dict: dict):
+    """
+    A variant of inject_context_processor that layers the event over the current context rather than
+    merging them. Requires materialize_context_processor to run before the renderer, which
+    woodchipper.configure takes care of.
+    """
+    return ContextEventDict(event_dict, context.logging_ctx.snapshot())
+
+
+def materialize_context_processor(logger: logging.Logger, method: str, event_dict):
+    """
+    Turns a ContextEventDict into a plain dict for renderers. Any other event dict is passed through.
+    """
+    if isinstance(event_dict, ContextEventDict):
+        return event_dict.to_dict()
+    return event_dict
+
+
 class GitVersionProcessor:
     """
     Loads the contents of a static file written during CI builds with the git revision info.
+
+    The file is read once and the prefixed `git.*` keys are cached. To pick up a file replaced while
+    running, set `refresh_interval` to check the file's modification time at most once every that many
+    seconds, or `check_mtime` to check it on every event. A missing or unreadable file is retried on
+    every event, so a file written after the first event is still picked up, unless `cache_missing` is
+    set, in which case it is cached as empty as well.
+
+    If the WOODCHIPPER_GIT_VERSION environment variable is set to a JSON object, it is used in place of
+    the file, which is then never read.
     """
 
-    def __init__(self, version_json_path="version.json"):
+    def __init__(
+        self,
+        version_json_path="version.json",
+        *,
+        refresh_interval: Optional[float] = None,
+        check_mtime: bool = False,
+        cache_missing: bool = False,
+    ):
         self.version_json_path = version_json_path
+        self.refresh_interval = refresh_interval
+        self.check_mtime = check_mtime
+        self.cache_missing = cache_missing
+        self._git_fields: Optional[Dict[str, Any]] = None
+        self._mtime_ns: Optional[int] = None
+        self._checked_at = time.monotonic()
+        self._from_env = False
 
-    def __call__(self, logger: logging.Logger, method: str, event_dict: dict):
+        env_version = os.getenv("WOODCHIPPER_GIT_VERSION")
+        if env_version:
+            try:
+                git_version = json.loads(env_version)
+            except json.JSONDecodeError:
+                git_version = None
+            if isinstance(git_version, dict):
+                self._git_fields = self._prefix_keys(git_version)
+                self._from_env = True
+
+    @staticmethod
+    def _prefix_keys(git_version: Dict[str, Any]) -> Dict[str, Any]:
+        return {f"git.{k}": v for k, v in git_version.items()}
+
+    def _stat_mtime_ns(self) -> Optional[int]:
+        try:
+            return os.stat(self.version_json_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self) -> Dict[str, Any]:
+        self._mtime_ns = self._stat_mtime_ns()
         try:
             with open(self.version_json_path) as ifs:
-                git_version = json.load(ifs)
-                event_dict.update({f"git.{k}": v for k, v in git_version.items()})
-        except (OSError, json.JSONDecodeError):
-            pass
+                git_fields = self._prefix_keys(json.load(ifs))
+        except (OSError, json.JSONDecodeError, AttributeError):
+            git_fields = {}
+        self._git_fields = git_fields
+        return git_fields
+
+    def _is_stale(self) -> bool:
+        if self._from_env:
+            return False
+        if not self._git_fields and not self.cache_missing:
+            return True
+        if self.check_mtime:
+            return self._stat_mtime_ns() != self._mtime_ns
+        if self.refresh_interval is not None:
+            now = time.monotonic()
+            if now - self._checked_at >= self.refresh_interval:
+                self._checked_at = now
+                return self._stat_mtime_ns() != self._mtime_ns
+        return False
+
+    def __call__(self, logger: logging.Logger, method: str, event_dict: dict):
+        git_fields = self._git_fields
+        if git_fields is None or self._is_stale():
+            git_fields = self._load()
+        if git_fields:
+            event_dict.update(git_fields)
         return event_dict
 
 
@@ -75,3 +187,127 @@ class DatadogTraceProcessor:
             event_dict["dd.version"] = ddtrace.config.version
 
         return event_dict
+
+
+class _SamplingBucket:
+    """The sampling state of one (logger, event) key."""
+
+    __slots__ = ("seen", "tokens", "refilled_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.seen = 0
+        self.tokens = tokens
+        self.refilled_at = now
+
+
+class SamplingProcessor:
+    """
+    Drops repetitive log messages, keyed by logger name and event. Messages are kept if they pass
+    both head sampling, which keeps the first of every `sample_rate` messages of a key, and, if `rate`
+    is set, a token bucket of `burst` messages per key refilled at `rate` messages per second.
+
+    Messages logged with a method in `keep_levels`, whose event or logging context holds one of the
+    values listed in `keep_values` for a key, or for which `keep_if(method, event_dict)` returns True
+    are always kept.
+
+    Dropped messages raise structlog.DropEvent, so this processor should come first in the chain, so
+    the rest never runs for them. Messages from the standard library, which go through
+    `foreign_pre_chain`, can't be dropped and are always kept. At most every `summary_interval`
+    seconds, on the next message kept, a summary message with the number of messages suppressed since
+    the last one is logged on `summary_logger`. At most `max_keys` keys are tracked at once.
+    """
+
+    def __init__(
+        self,
+        *,
+        sample_rate: int = 1,
+        rate: Optional[float] = None,
+        burst: int = 10,
+        keep_levels: Collection[str] = ("warning", "error", "critical", "exception"),
+        keep_values: Mapping[str, Collection[Any]] = {},
+        keep_if: Optional[Callable[[str, dict], bool]] = None,
+        summary_interval: float = 60.0,
+        summary_logger: str = "woodchipper.sampling",
+        max_keys: int = 10_000,
+    ):
+        if sample_rate < 1:
+            raise ValueError("sample_rate must be at least 1.")
+        self.sample_rate = sample_rate
+        self.rate = rate
+        self.burst = burst
+        self.keep_levels = frozenset(keep_levels)
+        self.keep_values = {key: frozenset(values) for key, values in keep_values.items()}
+        self.keep_if = keep_if
+        self.summary_interval = summary_interval
+        self.summary_logger = summary_logger
+        self.max_keys = max_keys
+        self._buckets: Dict[Tuple[str, Any], _SamplingBucket] = {}
+        self._suppressed: Dict[Tuple[str, Any], int] = {}
+        self._suppressed_count = 0
+        self._summarized_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _always_keep(self, method: str, event_dict: dict) -> bool:
+        if method in self.keep_levels:
+            return True
+        for key, values in self.keep_values.items():
+            value = event_dict[key] if key in event_dict else context.logging_ctx[key]
+            if value in values:
+                return True
+        return self.keep_if is not None and self.keep_if(method, event_dict)
+
+    def _sample(self, key: Tuple[str, Any], now: float) -> bool:
+        """Whether to keep the next message of `key`. Called holding the lock."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.clear()
+            bucket = self._buckets[key] = _SamplingBucket(self.burst, now)
+        bucket.seen += 1
+        if (bucket.seen - 1) % self.sample_rate:
+            return False
+        if self.rate is not None:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.refilled_at) * self.rate)
+            bucket.refilled_at = now
+            if bucket.tokens < 1:
+                return False
+            bucket.tokens -= 1
+        return True
+
+    def _take_summary(self, now: float) -> Optional[Dict[str, Any]]:
+        """Return the summary to log, if one is due. Called holding the lock."""
+        if now - self._summarized_at < self.summary_interval:
+            return None
+        self._summarized_at = now
+        if not self._suppressed_count:
+            return None
+        top_suppressed = sorted(self._suppressed.items(), key=lambda item: item[1], reverse=True)[:10]
+        summary = {
+            "sampling.suppressed_count": self._suppressed_count,
+            "sampling.suppressed_key_count": len(self._suppressed),
+            "sampling.top_suppressed": {f"{name}:{event}": count for (name, event), count in top_suppressed},
+        }
+        self._suppressed = {}
+        self._suppressed_count = 0
+        return summary
+
+    def __call__(self, logger: logging.Logger, method: str, event_dict: dict) -> dict:
+        name = getattr(logger, "name", "")
+        if (
+            event_dict.get("_from_structlog") is False
+            or name == self.summary_logger
+            or self._always_keep(method, event_dict)
+        ):
+            return event_dict
+        key = (name, event_dict.get("event"))
+        now = time.monotonic()
+        with self._lock:
+            if not self._sample(key, now):
+                self._suppressed_count += 1
+                if key in self._suppressed or len(self._suppressed) < self.max_keys:
+                    self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                raise structlog.DropEvent
+            summary = self._take_summary(now)
+        if summary is not None:
+            woodchipper.get_logger(self.summary_logger).info("Suppressed log messages.", **summary)
+        return event_dict